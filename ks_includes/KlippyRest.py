@@ -1,14 +1,33 @@
 import logging
 import re
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from ks_includes.metrics import metrics
 
 
 class KlippyRest:
-    def __init__(self, ip, port=7125, api_key=False):
+    # Read timeouts by endpoint prefix, the first match is used, the rest use the timeout of the call
+    timeouts = (
+        ("server/files/gcodes/", 10),
+        ("server/temperature_store", 10),
+        ("printer/gcode/help", 10),
+    )
+
+    def __init__(self, ip, port=7125, api_key=False, retries=2):
         self.ip = ip
         self.port = port
         self.api_key = api_key
-        self.status = ''
+        # Connections are kept alive and shared, each thread uses its own session on top of the same pool
+        # only GET is retried, connection errors are not as the caller polls while moonraker is down
+        self.adapter = HTTPAdapter(
+            pool_connections=2, pool_maxsize=8,
+            max_retries=Retry(total=retries, connect=0, backoff_factor=.2, status_forcelist=(502, 503, 504),
+                              allowed_methods=("GET",), raise_on_status=False)
+        )
+        self.local = threading.local()
 
     @property
     def endpoint(self):
@@ -35,13 +54,41 @@ class KlippyRest:
     def get_thumbnail_stream(self, thumbnail):
         return self.send_request(f"server/files/gcodes/{thumbnail}", json=False)
 
+    @property
+    def status(self):
+        # The error of the last request of this thread, requests run concurrently in other threads
+        return getattr(self.local, "status", '')
+
+    @status.setter
+    def status(self, value):
+        self.local.status = value
+
+    @property
+    def session(self):
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = self.local.session = requests.Session()
+            session.mount("http://", self.adapter)
+            session.mount("https://", self.adapter)
+        return session
+
+    def close(self):
+        self.adapter.close()
+
+    def get_timeout(self, method, timeout):
+        for prefix, value in self.timeouts:
+            if method.startswith(prefix):
+                return max(value, timeout)
+        return timeout
+
     def _do_request(self, method, request_method, data=None, json=None, json_response=True, timeout=3):
         url = f"{self.endpoint}/{method}"
         headers = {} if self.api_key is False else {"x-api-key": self.api_key}
         response_data = False
+        start = time.perf_counter()
         try:
-            callee = getattr(requests, request_method)
-            response = callee(url, json=json, data=data, headers=headers, timeout=timeout)
+            callee = getattr(self.session, request_method)
+            response = callee(url, json=json, data=data, headers=headers, timeout=self.get_timeout(method, timeout))
             response.raise_for_status()
             if json_response:
                 logging.debug(f"Sending request to {url}")
@@ -60,6 +107,8 @@ class KlippyRest:
             self.status = self.format_status(r)
         except Exception as e:
             self.status = self.format_status(e)
+        if metrics.enabled:
+            metrics.record(f"rest {method.split('?')[0]}", time.perf_counter() - start)
         if response_data:
             self.status = ''
         else:
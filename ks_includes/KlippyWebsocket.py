@@ -3,6 +3,9 @@
 import threading
 import json
 import logging
+import time
+from collections import deque
+from concurrent.futures import Future
 
 import gi
 import websocket
@@ -10,13 +13,12 @@ import websocket
 gi.require_version("Gtk", "3.0")
 from gi.repository import GLib
 from ks_includes.KlippyGcodes import KlippyGcodes
+from ks_includes.metrics import metrics
 
 
 class KlippyWebsocket(threading.Thread):
-    _req_id = 0
     connected = False
     connecting = True
-    callback_table = {}
     reconnect_count = 0
     max_retries = 4
 
@@ -27,6 +29,11 @@ class KlippyWebsocket(threading.Thread):
         self._screen = screen
         self._callback = callback
         self.klippy = MoonrakerApi(self)
+        self.status = StatusDispatcher(
+            self._callback['on_message'] if "on_message" in self._callback else None,
+            screen._config.get_main_config().getfloat("status_update_rate", 10)
+        )
+        self.requests = RequestManager(self._send)
         self.ws = None
         self.closing = False
         self.host = host
@@ -100,44 +107,55 @@ class KlippyWebsocket(threading.Thread):
     def close(self):
         self.closing = True
         self.connecting = False
+        self.status.clear()
+        self.requests.clear("Connection to Moonraker closed")
         if self.ws is not None:
             self.ws.close()
 
     def on_message(self, *args):
         message = args[1] if len(args) == 2 else args[0]
+        metrics.count("websocket.messages")
+        if self._screen.recorder is not None:
+            self._screen.recorder.write("ws", message)
         response = json.loads(message)
-        if "id" in response and response['id'] in self.callback_table:
-            args = (response,
-                    self.callback_table[response['id']][1],
-                    self.callback_table[response['id']][2],
-                    *self.callback_table[response['id']][3])
-            GLib.idle_add(self.callback_table[response['id']][0], *args)
-            self.callback_table.pop(response['id'])
-            return
+        if "id" in response:
+            if isinstance(response.get("result"), dict) and "status" in response["result"]:
+                # Subscriptions and queries hold a fresh status, the older deltas go first
+                self.status.flush_pending()
+            if self.requests.resolve(response):
+                return
 
         if "method" in response and "on_message" in self._callback:
             args = response['method'], response['params'][0] if "params" in response else {}
-            GLib.idle_add(self._callback['on_message'], *args)
+            if args[0] == "notify_status_update":
+                self.status.push(args[1])
+                return
+            # Deliver pending status before anything else to keep the order of events
+            self.status.flush_pending()
+            metrics.idle_add(self._callback['on_message'], *args)
         return
 
-    def send_method(self, method, params=None, callback=None, *args):
+    def send_method(self, method, params=None, callback=None, *args, on_error=None):
+        # callback gets the responses of Moonraker, on_error (optional) gets the timeouts
+        # and lost connections as an error response
         if not self.connected:
             return False
         if params is None:
             params = {}
+        return self.requests.submit(method, params, callback, args, on_error=on_error)
 
-        self._req_id += 1
-        if callback is not None:
-            self.callback_table[self._req_id] = [callback, method, params, [*args]]
+    def send_method_future(self, method, params=None):
+        # The future is resolved from the websocket thread with the response
+        # or fails with TimeoutError / ConnectionError
+        future = Future()
+        if not self.connected:
+            future.set_exception(ConnectionError("Not connected to Moonraker"))
+            return future
+        self.requests.submit(method, params if params is not None else {}, future=future)
+        return future
 
-        data = {
-            "jsonrpc": "2.0",
-            "method": method,
-            "params": params,
-            "id": self._req_id
-        }
+    def _send(self, data):
         self.ws.send(json.dumps(data))
-        return True
 
     def on_open(self, *args):
         logging.info("Moonraker Websocket Open")
@@ -167,6 +185,7 @@ class KlippyWebsocket(threading.Thread):
             GLib.idle_add(self._callback['on_close'], "Lost Connection to Moonraker")
         logging.info("Moonraker Websocket Closed")
         self.connected = False
+        self.requests.clear("Lost Connection to Moonraker")
 
     @staticmethod
     def on_error(*args):
@@ -174,6 +193,226 @@ class KlippyWebsocket(threading.Thread):
         logging.debug(f"Websocket error: {error}")
 
 
+class StatusDispatcher:
+    """Coalesces notify_status_update deltas from the websocket thread
+
+    Deltas are merged per object and field, and delivered to the main loop as a single update
+    at most once every frame, limited by the configured rate (in Hz)
+    """
+    def __init__(self, callback, rate=10):
+        self._callback = callback
+        self._interval = 1 / rate if rate and rate > 0 else 0
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._scheduled = False
+        self._last_flush = 0
+
+    def push(self, data):
+        if self._callback is None:
+            return
+        with self._lock:
+            for obj, fields in data.items():
+                if obj in self._pending and isinstance(fields, dict):
+                    self._pending[obj].update(fields)
+                else:
+                    self._pending[obj] = fields.copy() if isinstance(fields, dict) else fields
+            if self._scheduled:
+                return
+            self._scheduled = True
+        delay = self._interval - (time.monotonic() - self._last_flush)
+        if delay > 0:
+            GLib.timeout_add(max(1, int(delay * 1000)), self._flush)
+        else:
+            metrics.idle_add(self._flush)
+
+    def _take(self):
+        with self._lock:
+            data = self._pending
+            self._pending = {}
+            self._scheduled = False
+        return data
+
+    def _flush(self):
+        data = self._take()
+        self._last_flush = time.monotonic()
+        if data:
+            self._callback("notify_status_update", data)
+        return False
+
+    def flush_pending(self):
+        # Called from the websocket thread, the already scheduled flush will find nothing to deliver
+        data = self._take()
+        if data:
+            metrics.idle_add(self._callback, "notify_status_update", data)
+
+    def clear(self):
+        self._take()
+
+
+class RequestManager:
+    """Tracks the requests sent to Moonraker until they are answered, fail or expire
+
+    The number of requests of a method in flight is limited, the rest wait in order,
+    and the round trip time of each method is measured
+    """
+    # Seconds before a request expires, by method prefix, the first match is used
+    timeouts = (
+        ("printer.gcode.script", 3600),
+        ("machine.update.", 3600),
+    )
+    default_timeout = 60
+    # Requests in flight by method, 0 is unlimited, gcode is queued by Klipper itself
+    limits = {
+        "printer.gcode.script": 0,
+        "printer.emergency_stop": 0,
+    }
+    default_limit = 8
+
+    def __init__(self, send):
+        self._send = send
+        self._lock = threading.Lock()
+        self._req_id = 0
+        self._timer = None
+        self.in_flight = {}
+        self.queued = {}
+        self.counts = {}
+        self.stats = {}
+
+    def get_timeout(self, method):
+        for prefix, timeout in self.timeouts:
+            if method.startswith(prefix):
+                return timeout
+        return self.default_timeout
+
+    def submit(self, method, params, callback=None, args=(), future=None, on_error=None):
+        with self._lock:
+            self._req_id += 1
+            req = {"id": self._req_id, "method": method, "params": params, "callback": callback, "args": args,
+                   "future": future, "on_error": on_error, "sent": 0, "deadline": 0}
+            limit = self.limits.get(method, self.default_limit)
+            if limit and self.counts.get(method, 0) >= limit:
+                logging.debug(f"Queueing {method}, {limit} already in flight")
+                self.queued.setdefault(method, deque()).append(req)
+                return True
+            self._start(req)
+        return self._transmit(req)
+
+    def _start(self, req):
+        # Called with the lock held
+        req['sent'] = time.monotonic()
+        req['deadline'] = req['sent'] + self.get_timeout(req['method'])
+        self.in_flight[req['id']] = req
+        self.counts[req['method']] = self.counts.get(req['method'], 0) + 1
+        if self._timer is None:
+            self._timer = GLib.timeout_add_seconds(5, self.expire)
+
+    def _release(self, req):
+        # Called with the lock held, returns the next queued request of the method, already started
+        self.counts[req['method']] -= 1
+        queue = self.queued.get(req['method'])
+        if not queue:
+            return None
+        nxt = queue.popleft()
+        self._start(nxt)
+        return nxt
+
+    def _transmit(self, req):
+        try:
+            self._send({"jsonrpc": "2.0", "method": req['method'], "params": req['params'], "id": req['id']})
+            return True
+        except Exception as e:
+            logging.error(f"Unable to send {req['method']}: {e}")
+            with self._lock:
+                if self.in_flight.pop(req['id'], None) is None:
+                    return False
+                nxt = self._release(req)
+            self._fail(req, 503, f"Unable to send: {e}", ConnectionError)
+            if nxt is not None:
+                self._transmit(nxt)
+            return False
+
+    def _record(self, method, latency=None, error=False, timeout=False):
+        if method not in self.stats:
+            self.stats[method] = {"count": 0, "errors": 0, "timeouts": 0, "total": 0, "max": 0, "last": 0}
+        stat = self.stats[method]
+        if timeout:
+            stat['timeouts'] += 1
+            return
+        stat['count'] += 1
+        stat['errors'] += error
+        stat['total'] += latency
+        stat['last'] = latency
+        stat['max'] = max(stat['max'], latency)
+
+    def resolve(self, response):
+        # Called from the websocket thread, False if the response doesn't belong to a tracked request
+        with self._lock:
+            req = self.in_flight.pop(response['id'], None)
+            if req is None:
+                return False
+            self._record(req['method'], time.monotonic() - req['sent'], "error" in response)
+            nxt = self._release(req)
+        if nxt is not None:
+            self._transmit(nxt)
+        if req['callback'] is not None:
+            metrics.idle_add(req['callback'], response, req['method'], req['params'], *req['args'])
+        if req['future'] is not None and not req['future'].done():
+            req['future'].set_result(response)
+        return True
+
+    def _fail(self, req, code, message, exception):
+        # Plain callbacks expect a real response, only the requests that asked for it get the failure
+        if req['on_error'] is not None:
+            response = {"jsonrpc": "2.0", "id": req['id'], "error": {"code": code, "message": message}}
+            metrics.idle_add(req['on_error'], response, req['method'], req['params'], *req['args'])
+        if req['future'] is not None and not req['future'].done():
+            req['future'].set_exception(exception(message))
+
+    def expire(self):
+        now = time.monotonic()
+        expired = []
+        started = []
+        with self._lock:
+            for req in [req for req in self.in_flight.values() if req['deadline'] < now]:
+                del self.in_flight[req['id']]
+                self._record(req['method'], timeout=True)
+                expired.append(req)
+                nxt = self._release(req)
+                if nxt is not None:
+                    started.append(nxt)
+            if not self.in_flight and not self.queued:
+                self._timer = None
+        for req in expired:
+            logging.error(f"{req['method']} timed out after {now - req['sent']:.0f}s")
+            self._fail(req, 408, "Request timed out", TimeoutError)
+        for req in started:
+            self._transmit(req)
+        return self._timer is not None
+
+    def clear(self, message):
+        # Fails everything in flight or queued, the responses of the old connection will never arrive
+        with self._lock:
+            pending = list(self.in_flight.values())
+            for queue in self.queued.values():
+                pending.extend(queue)
+            self.in_flight = {}
+            self.queued = {}
+            self.counts = {}
+        if pending:
+            logging.info(f"Dropping {len(pending)} pending requests")
+        for req in pending:
+            self._fail(req, 503, message, ConnectionError)
+
+    def get_stats(self):
+        with self._lock:
+            stats = {method: dict(stat) for method, stat in self.stats.items()}
+            for method, stat in stats.items():
+                stat['in_flight'] = self.counts.get(method, 0)
+                stat['queued'] = len(self.queued.get(method, ()))
+                stat['average'] = stat['total'] / stat['count'] if stat['count'] else 0
+        return stats
+
+
 class MoonrakerApi:
     def __init__(self, ws):
         self._ws = ws
@@ -220,19 +459,22 @@ class MoonrakerApi:
             *args
         )
 
-    def get_file_metadata(self, filename, callback=None, *args):
+    def get_file_metadata(self, filename, callback=None, *args, on_error=None):
         return self._ws.send_method(
             "server.files.metadata",
             {"filename": filename},
             callback,
-            *args
+            *args,
+            on_error=on_error
         )
 
-    def object_subscription(self, updates):
+    def object_subscription(self, updates, callback=None, *args):
         logging.debug("Sending printer.objects.subscribe")
         return self._ws.send_method(
             "printer.objects.subscribe",
-            updates
+            updates,
+            callback,
+            *args
         )
 
     def power_device_off(self, device, callback=None, *args):
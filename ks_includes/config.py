@@ -108,11 +108,9 @@ class KlipperScreenConfig:
         self._create_configurable_options(screen)
 
     def create_translations(self):
-        lang_path = os.path.join(klipperscreendir, "ks_includes", "locales")
-        self.lang_list = [d for d in os.listdir(lang_path) if not os.path.isfile(os.path.join(lang_path, d))]
+        self.lang_path = os.path.join(klipperscreendir, "ks_includes", "locales")
+        self.lang_list = [d for d in os.listdir(self.lang_path) if not os.path.isfile(os.path.join(self.lang_path, d))]
         self.lang_list.sort()
-        for lng in self.lang_list:
-            self.langs[lng] = gettext.translation('KlipperScreen', localedir=lang_path, languages=[lng], fallback=True)
 
         lang = self.get_main_config().get("language", None)
         logging.debug(f"Selected lang: {lang} OS lang: {locale.getlocale()[0]}")
@@ -135,7 +133,7 @@ class KlipperScreenConfig:
             logging.info(f"Available lang list {self.lang_list}")
             lang = "en"
         logging.info(f"Using lang {lang}")
-        self.lang = self.langs[lang]
+        self.lang = self.get_translation(lang)
         self.lang.install(names=['gettext', 'ngettext'])
 
     def validate_config(self, config, string="", remove=False):
@@ -156,15 +154,18 @@ class KlipperScreenConfig:
                 bools = (
                     'invert_x', 'invert_y', 'invert_z',  'show_cursor', 'confirm_estop',
                     'autoclose_popups', 'use_dpms', 'use_default_menu', 'use-matchbox-keyboard',
-                      "voice_notify", "shutdown_print_end", "filament_box_power"
+                      "voice_notify", "shutdown_print_end", "filament_box_power", "warm_start", "metrics"
                 )
                 strs = (
                     'default_printer', 'language', 'print_sort_dir', 'screen_blanking', 
-                    'print_estimate_method', 'screen_blanking',  "screen_off_devices",
+                    'print_estimate_method', 'screen_blanking',  "screen_off_devices", 'preload_panels',
+                    'websocket_record',
                 )
                 numbers = (
                     'job_complete_timeout', 'job_error_timeout', 'move_speed_xy', 'move_speed_z',
-                    'print_estimate_compensation', 'width', 'height',
+                    'print_estimate_compensation', 'width', 'height', 'status_update_rate',
+                    'thumbnail_memory_cache', 'thumbnail_disk_cache', 'preload_memory',
+                    'metrics_log_interval',
                 )
             elif section.startswith('printer '):
                 bools = (
@@ -432,6 +433,13 @@ class KlipperScreenConfig:
     def get_config(self):
         return self.config
 
+    def get_translation(self, lang):
+        # Loaded on first use, only the selected language is needed at startup
+        if lang not in self.langs:
+            self.langs[lang] = gettext.translation('KlipperScreen', localedir=self.lang_path, languages=[lang],
+                                                   fallback=True)
+        return self.langs[lang]
+
     def get_configurable_options(self):
         return self.configurable_options
 
@@ -454,6 +462,13 @@ class KlipperScreenConfig:
 
         return menu_items
 
+    def get_menu_panels(self):
+        # Every panel reachable from the menus
+        return sorted({
+            self.config[i].get("panel") for i in self.config.sections()
+            if i.startswith("menu ") and self.config[i].get("panel")
+        })
+
     def get_menu_name(self, menu="__main", subsection=""):
         name = f"menu {menu} {subsection}" if subsection != "" else f"menu {menu}"
         return False if name not in self.config else self.config[name].get('name')
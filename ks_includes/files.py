@@ -1,23 +1,253 @@
+import bisect
+import copy
+import heapq
+import itertools
+import json
 import logging
 import os
+import re
+import threading
 
 import gi
 
 gi.require_version("Gtk", "3.0")
 from gi.repository import GLib
+from ks_includes import functions
+
+
+class FileCatalog:
+    """Index of the gcode files by path and by directory, keeping the sort orders up to date
+
+    Paths are relative to the gcodes root, the root directory is ""
+    """
+    orders = {
+        "name": lambda path, info: (path,),
+        "modified": lambda path, info: (info.get('modified', 0), path),
+        "size": lambda path, info: (info.get('size', 0), path),
+    }
+
+    def __init__(self):
+        self.index = {}
+        self.keys = {}
+        self.sorted = {order: [] for order in self.orders}
+        self.tree = {"": self.new_node()}
+
+    def __contains__(self, path):
+        return path in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def add(self, path, info):
+        if path in self.index:
+            self._unsort(path)
+        else:
+            self.add_directory(os.path.dirname(path))
+            self.tree[os.path.dirname(path)]['files'].add(path)
+        self.index[path] = info
+        self._sort(path)
+        self._touch(path)
+
+    def update(self, path):
+        # Call after the size or modification time of the file changed
+        if path in self.index:
+            self._unsort(path)
+            self._sort(path)
+            self._touch(path)
+
+    def _touch(self, path):
+        # Directories without a known time take the newest of their files
+        modified = self.index[path].get('modified', 0)
+        directory = os.path.dirname(path)
+        while True:
+            self.tree[directory]['modified'] = max(self.tree[directory]['modified'], modified)
+            if not directory:
+                break
+            directory = os.path.dirname(directory)
+
+    def remove(self, path):
+        info = self.index.pop(path, None)
+        if info is not None:
+            self._unsort(path)
+            self.tree[os.path.dirname(path)]['files'].discard(path)
+        return info
+
+    def new_node(self):
+        return {"dirs": set(), "files": set(), "modified": 0, "sorted": {order: [] for order in self.orders}}
+
+    def _sort(self, path):
+        keys = self.keys[path] = {order: key(path, self.index[path]) for order, key in self.orders.items()}
+        node = self.tree[os.path.dirname(path)]
+        for order, key in keys.items():
+            bisect.insort(self.sorted[order], key)
+            bisect.insort(node['sorted'][order], key)
+
+    def _unsort(self, path):
+        node = self.tree[os.path.dirname(path)]
+        for order, key in self.keys.pop(path).items():
+            del self.sorted[order][bisect.bisect_left(self.sorted[order], key)]
+            del node['sorted'][order][bisect.bisect_left(node['sorted'][order], key)]
+
+    def add_directory(self, directory, modified=None):
+        if directory not in self.tree:
+            self.add_directory(os.path.dirname(directory))
+            self.tree[os.path.dirname(directory)]['dirs'].add(directory)
+            self.tree[directory] = self.new_node()
+        if modified is not None:
+            self.tree[directory]['modified'] = modified
+
+    def list_tree(self, directory):
+        # The files in the directory and all its subdirectories
+        files = []
+        pending = [directory] if directory in self.tree else []
+        while pending:
+            node = self.tree[pending.pop()]
+            files.extend(node['files'])
+            pending.extend(node['dirs'])
+        return files
+
+    def remove_directory(self, directory):
+        # Removes the directory and everything in it, returns the removed files
+        if not directory or directory not in self.tree:
+            return []
+        files = self.list_tree(directory)
+        for path in files:
+            self.remove(path)
+        pending = [directory]
+        while pending:
+            pending.extend(self.tree.pop(pending.pop())['dirs'])
+        self.tree[os.path.dirname(directory)]['dirs'].discard(directory)
+        return files
+
+    def list(self, order="name", reverse=False):
+        keys = reversed(self.sorted[order]) if reverse else self.sorted[order]
+        return [key[-1] for key in keys]
+
+    def list_directory(self, directory, order="name", reverse=False, start=0, end=None):
+        # A slice of the files in the directory in the order, without sorting
+        if directory not in self.tree:
+            return []
+        keys = self.tree[directory]['sorted'][order]
+        end = len(keys) if end is None else min(end, len(keys))
+        if reverse:
+            return [keys[len(keys) - 1 - i][-1] for i in range(start, end)]
+        return [key[-1] for key in keys[start:end]]
+
+    def get_subdirectories(self, directory):
+        return sorted(self.tree[directory]['dirs']) if directory in self.tree else []
+
+
+class MetadataLoader:
+    """Requests the metadata of the files a few at a time, the files on screen first
+
+    The metadata is kept on disk and reused while the size and modification time of the file don't change
+    """
+    VISIBLE = 0
+    BACKGROUND = 1
+    window = 4
+
+    def __init__(self, files, path):
+        self._files = files
+        self.path = path
+        self.cache = self.load()
+        self.queue = []
+        self.pending = {}
+        self.in_flight = set()
+        self.counter = itertools.count()
+        self.save_timeout = None
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as file:
+                cache = json.load(file)
+            logging.info(f"Loaded the metadata of {len(cache)} files from cache")
+            return cache
+        except Exception as e:
+            logging.error(f"Unable to load the metadata cache {self.path}: {e}")
+            return {}
+
+    def get_cached(self, filename):
+        entry = self.cache.get(filename)
+        info = self._files.files.get(filename)
+        if entry is None or info is None or entry['size'] != info['size'] or entry['modified'] != info['modified']:
+            return None
+        return copy.deepcopy(entry['metadata'])
+
+    def request(self, filename, priority=BACKGROUND):
+        if filename in self.in_flight or self.pending.get(filename, priority + 1) <= priority:
+            return
+        self.pending[filename] = priority
+        heapq.heappush(self.queue, (priority, next(self.counter), filename))
+        self.send()
+
+    def prioritize(self, filenames):
+        for filename in filenames:
+            if self.pending.get(filename, self.VISIBLE) > self.VISIBLE:
+                self.pending[filename] = self.VISIBLE
+                heapq.heappush(self.queue, (self.VISIBLE, next(self.counter), filename))
+
+    def send(self):
+        while self.queue and len(self.in_flight) < self.window:
+            priority, _, filename = self.queue[0]
+            if self.pending.get(filename) != priority or filename not in self._files.files:
+                heapq.heappop(self.queue)
+                if self.pending.get(filename) == priority:
+                    del self.pending[filename]
+                continue
+            if not self._files._screen._ws.klippy.get_file_metadata(filename, self._files._callback,
+                                                                    on_error=self._files._callback):
+                # Not connected, the queue is resumed by the next refresh
+                break
+            heapq.heappop(self.queue)
+            del self.pending[filename]
+            self.in_flight.add(filename)
+
+    def done(self, filename, metadata=None):
+        self.in_flight.discard(filename)
+        if metadata is not None and filename in self._files.files:
+            info = self._files.files[filename]
+            self.cache[filename] = {
+                "size": metadata.get('size', info['size']),
+                "modified": metadata.get('modified', info['modified']),
+                "metadata": copy.deepcopy(metadata),
+            }
+            if self.path and self.save_timeout is None:
+                self.save_timeout = GLib.timeout_add_seconds(10, self.save)
+        self.send()
+
+    def save(self):
+        self.save_timeout = None
+        # Only the files that still exist, the entries are not modified once stored so they can be written in a thread
+        cache = {filename: entry for filename, entry in self.cache.items() if filename in self._files.files}
+        self.cache = cache
+        threading.Thread(target=self.write, args=(cache,), daemon=True).start()
+        return False
+
+    def write(self, cache):
+        try:
+            with open(f"{self.path}.tmp", "w") as file:
+                json.dump(cache, file)
+            os.replace(f"{self.path}.tmp", self.path)
+        except Exception as e:
+            logging.error(f"Unable to save the metadata cache {self.path}: {e}")
 
 
 class KlippyFiles:
     def __init__(self, screen):
         self._screen = screen
         self.callbacks = []
-        self.files = {}
-        self.filelist = []
-        self.directories = []
+        self.catalog = FileCatalog()
+        self.files = self.catalog.index
         self.gcodes_path = None
+        data_dir = functions.get_data_dir()
+        # Printers can have files with the same names and sizes, each one has its own cache
+        printer = re.sub(r'[^\w.-]', '_', screen.connecting_to_printer or "")
+        self.metadata = MetadataLoader(self, os.path.join(data_dir, f"metadata-{printer}.json") if data_dir else None)
 
     def initialize(self):
-        if "virtual_sdcard" in self._screen.printer.get_config_section_list():
+        if self._screen.printer.config_section_exists("virtual_sdcard"):
             vsd = self._screen.printer.get_config_section("virtual_sdcard")
             if "path" in vsd:
                 self.gcodes_path = os.path.expanduser(vsd['path'])
@@ -27,22 +257,21 @@ class KlippyFiles:
         self._screen = None
         self.callbacks = None
         self.files = None
-        self.filelist = None
-        self.directories = None
+        self.catalog = None
         self.gcodes_path = None
 
     def _callback(self, result, method, params):
         if method == "server.files.list":
             if "result" in result and isinstance(result['result'], list):
                 newfiles = []
-                deletedfiles = self.filelist.copy()
+                listed = set()
                 for item in result['result']:
                     file = item['filename'] if "filename" in item else item['path']
-                    if file in self.files:
-                        deletedfiles.remove(file)
-                    else:
+                    listed.add(file)
+                    if file not in self.files:
                         newfiles.append(file)
                         self.add_file(item, False)
+                deletedfiles = [file for file in self.files if file not in listed]
 
                 if newfiles or len(deletedfiles) > 0:
                     self.run_callbacks(newfiles, deletedfiles)
@@ -59,41 +288,53 @@ class KlippyFiles:
                 newfiles = []
                 for file in result['result']['files']:
                     fullpath = f"{directory}/{file['filename']}"
-                    if fullpath not in self.filelist:
+                    if fullpath not in self.files:
                         newfiles.append(fullpath)
 
                 if newfiles:
                     self.run_callbacks(newfiles)
         elif method == "server.files.metadata":
             if "error" in result.keys():
-                logging.debug(f"Error in getting metadata for {params['filename']}. Retrying in 6 seconds")
+                logging.debug(f"Error in getting metadata for {params['filename']}")
+                self.metadata.done(params['filename'])
                 return
-
-            for x in result['result']:
-                self.files[params['filename']][x] = result['result'][x]
-            if "thumbnails" in self.files[params['filename']]:
-                self.files[params['filename']]['thumbnails'].sort(key=lambda y: y['size'], reverse=True)
-
-                for thumbnail in self.files[params['filename']]['thumbnails']:
-                    thumbnail['local'] = False
-                    if self.gcodes_path is not None:
-                        fpath = os.path.join(self.gcodes_path, params['filename'])
-                        fdir = os.path.dirname(fpath)
-                        path = os.path.join(fdir, thumbnail['relative_path'])
-                        if os.access(path, os.R_OK):
-                            thumbnail['local'] = True
-                            thumbnail['path'] = path
-                    if thumbnail['local'] is False:
-                        fdir = os.path.dirname(params['filename'])
-                        thumbnail['path'] = os.path.join(fdir, thumbnail['relative_path'])
-            self.run_callbacks(mods=[params['filename']])
+            self.metadata.done(params['filename'], result['result'])
+            self.set_metadata(params['filename'], result['result'])
         elif method == "server.files.get_directory":
             if 'result' not in result or 'dirs' not in result['result']:
                 return
+            # The tree comes from the paths of the file list, this only adds empty directories and their times
+            parent = params['path'][7:] if params['path'].startswith('gcodes/') else ""
             for x in result['result']['dirs']:
-                if x not in self.directories and not x['dirname'].startswith('.'):
-                    self.directories.append(x)
-                    self.get_dir_info(f"{params['path']}/{x['dirname']}")
+                if not x['dirname'].startswith('.'):
+                    directory = os.path.join(parent, x['dirname'])
+                    self.catalog.add_directory(directory, max(x['modified'], self.get_dir_modified(directory)))
+                    if not self.catalog.list_tree(directory):
+                        # The file list doesn't show what is inside directories without files
+                        self.get_dir_info(f"gcodes/{directory}")
+
+    def set_metadata(self, filename, metadata):
+        if filename not in self.files:
+            return
+        for x in metadata:
+            self.files[filename][x] = metadata[x]
+        self.catalog.update(filename)
+        if "thumbnails" in self.files[filename]:
+            self.files[filename]['thumbnails'].sort(key=lambda y: y['size'], reverse=True)
+
+            for thumbnail in self.files[filename]['thumbnails']:
+                thumbnail['local'] = False
+                if self.gcodes_path is not None:
+                    fpath = os.path.join(self.gcodes_path, filename)
+                    fdir = os.path.dirname(fpath)
+                    path = os.path.join(fdir, thumbnail['relative_path'])
+                    if os.access(path, os.R_OK):
+                        thumbnail['local'] = True
+                        thumbnail['path'] = path
+                if thumbnail['local'] is False:
+                    fdir = os.path.dirname(filename)
+                    thumbnail['path'] = os.path.join(fdir, thumbnail['relative_path'])
+        self.run_callbacks(mods=[filename])
 
     def add_file(self, item, notify=True):
         if 'filename' not in item and 'path' not in item:
@@ -101,18 +342,17 @@ class KlippyFiles:
             return
 
         filename = item['path'] if "path" in item else item['filename']
-        if filename in self.filelist:
+        if filename in self.files:
             logging.info(f"File already exists: {filename}")
             self.request_metadata(filename)
             args = None, None, [filename]
             GLib.idle_add(self.run_callbacks, *args)
             return
 
-        self.filelist.append(filename)
-        self.files[filename] = {
+        self.catalog.add(filename, {
             "size": item['size'],
             "modified": item['modified']
-        }
+        })
         self.request_metadata(filename)
         if notify is True:
             self.run_callbacks(newfiles=[filename])
@@ -128,13 +368,33 @@ class KlippyFiles:
             return
 
         if data['action'] == "create_dir":
-            self._screen._ws.klippy.get_file_dir(f"gcodes/{data['item']['path']}", self._callback)
+            self.catalog.add_directory(data['item']['path'], data['item'].get('modified'))
+        elif data['action'] == "delete_dir":
+            deletedfiles = self.catalog.remove_directory(data['item']['path'])
+            if deletedfiles:
+                self.run_callbacks(deletedfiles=deletedfiles)
+        elif data['action'] == "move_dir":
+            source = data['source_item']['path']
+            newfiles = []
+            for path in self.catalog.list_tree(source):
+                info = self.files[path]
+                newfiles.append(data['item']['path'] + path[len(source):])
+                self.add_file({"path": newfiles[-1], "size": info['size'], "modified": info['modified']}, False)
+            deletedfiles = self.catalog.remove_directory(source)
+            self.catalog.add_directory(data['item']['path'], data['item'].get('modified'))
+            if newfiles or deletedfiles:
+                self.run_callbacks(newfiles=newfiles, deletedfiles=deletedfiles)
         elif data['action'] == "create_file":
             self.add_file(data['item'])
         elif data['action'] == "delete_file":
             self.remove_file(data['item']['path'])
         elif data['action'] == "modify_file":
-            self.request_metadata(data['item']['path'])
+            if data['item']['path'] in self.files:
+                for key in ("size", "modified"):
+                    if key in data['item']:
+                        self.files[data['item']['path']][key] = data['item'][key]
+                self.catalog.update(data['item']['path'])
+            self.request_metadata(data['item']['path'], force=True)
         elif data['action'] == "move_file":
             self.add_file(data['item'], False)
             self.remove_file(data['source_item']['path'], False)
@@ -146,7 +406,7 @@ class KlippyFiles:
             self.callbacks.pop(self.callbacks.index(callback))
 
     def file_exists(self, filename):
-        return filename in self.filelist
+        return filename in self.files
 
     def file_metadata_exists(self, filename):
         if self.file_exists(filename):
@@ -168,23 +428,29 @@ class KlippyFiles:
             return False
         return "thumbnails" in self.files[filename] and len(self.files[filename]) > 0
 
-    def request_metadata(self, filename):
-        if filename not in self.filelist:
+    def request_metadata(self, filename, force=False):
+        if filename not in self.files:
             return False
-        self._screen._ws.klippy.get_file_metadata(filename, self._callback)
+        metadata = None if force else self.metadata.get_cached(filename)
+        if metadata is not None:
+            self.set_metadata(filename, metadata)
+            return
+        self.metadata.request(filename, self.metadata.VISIBLE if force else self.metadata.BACKGROUND)
+
+    def prioritize_metadata(self, filenames):
+        self.metadata.prioritize(filenames)
+        self.metadata.send()
 
     def refresh_files(self):
         self._screen._ws.klippy.get_file_list(self._callback)
         self._screen._ws.klippy.get_dir_info(self._callback)
+        self.metadata.send()
         return False
 
     def remove_file(self, filename, notify=True):
-        if filename not in self.filelist:
+        if self.catalog.remove(filename) is None:
             return
 
-        self.filelist.remove(filename)
-        self.files.pop(filename, None)
-
         if notify is True:
             self.run_callbacks(deletedfiles=[filename])
 
@@ -202,8 +468,14 @@ class KlippyFiles:
             GLib.idle_add(cb, *args)
         return False
 
-    def get_file_list(self):
-        return self.filelist
+    def get_file_list(self, order="name", reverse=False):
+        return self.catalog.list(order, reverse)
+
+    def get_dir_file_list(self, directory, order="name", reverse=False, start=0, end=None):
+        return self.catalog.list_directory(directory, order, reverse, start, end)
+
+    def get_dir_modified(self, directory):
+        return self.catalog.tree[directory]['modified'] if directory in self.catalog.tree else 0
 
     def get_file_info(self, filename):
         if filename not in self.files:
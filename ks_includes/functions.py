@@ -100,6 +100,67 @@ def get_software_version():
     return "?"
 
 
+def get_data_dir(*subdirs):
+    # Inside printer_data when it exists, the directory is created if needed, None if that's not possible
+    printer_data = os.path.expanduser("~/printer_data")
+    if os.path.isdir(printer_data):
+        path = os.path.join(printer_data, "KlipperScreen", *subdirs)
+    else:
+        path = os.path.join(os.path.expanduser("~/.cache"), "KlipperScreen", *subdirs)
+    try:
+        os.makedirs(path, exist_ok=True)
+    except OSError as e:
+        logging.error(f"Unable to create {path}: {e}")
+        return None
+    return path
+
+
+class StartupTracer:
+    """Time spent in each phase of the startup, logged once the printer is initialized"""
+    def __init__(self):
+        self.last = time.monotonic()
+        self.phases = []
+        self.done = False
+        age = self.get_process_age()
+        if age is not None:
+            self.phases.append(("imports", age))
+
+    @staticmethod
+    def get_process_age():
+        # Seconds since the process started, covers the interpreter startup and the imports
+        try:
+            with open("/proc/self/stat") as file:
+                start = int(file.read().rsplit(")", 1)[1].split()[19]) / os.sysconf("SC_CLK_TCK")
+            with open("/proc/uptime") as file:
+                return float(file.read().split()[0]) - start
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def mark(self, phase):
+        # Ends the phase, only the first time it's reached is recorded
+        if self.done or phase in (name for name, _ in self.phases):
+            return
+        now = time.monotonic()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self):
+        if self.done:
+            return
+        self.done = True
+        phases = ", ".join(f"{name} {elapsed:.2f}s" for name, elapsed in self.phases)
+        logging.info(f"Startup: {phases}, total {sum(elapsed for _, elapsed in self.phases):.2f}s")
+
+
+def get_memory_usage():
+    # Resident memory of this process in bytes, None if it can't be read
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
 def patch_threading_excepthook():
     """Installs our exception handler into the threading modules Thread object
     Inspired by https://bugs.python.org/issue1230540
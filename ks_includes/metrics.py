@@ -0,0 +1,143 @@
+import functools
+import logging
+import threading
+import time
+
+import gi
+
+gi.require_version("Gtk", "3.0")
+from gi.repository import GLib
+
+
+class Metrics:
+    """Latency of the main loop and timings of the hot paths, collected only while enabled
+
+    Timings are kept per name as [count, total, max] since the last reset, they can be recorded from any thread
+    """
+    probe_interval = 100
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.timings = {}
+        self.counters = {}
+        self.idle_depth = self.idle_depth_max = 0
+        self.since = time.monotonic()
+        self.probe_timeout = None
+        self.log_timeout = None
+
+    def start(self, log_interval=0):
+        if not self.enabled:
+            logging.info("Collecting metrics")
+            self.enabled = True
+            self.reset()
+            self.probe_timeout = GLib.timeout_add(self.probe_interval, self._probe, time.monotonic())
+        if log_interval > 0 and self.log_timeout is None:
+            self.log_timeout = GLib.timeout_add_seconds(log_interval, self.log)
+
+    def stop(self):
+        self.enabled = False
+        if self.probe_timeout is not None:
+            GLib.source_remove(self.probe_timeout)
+            self.probe_timeout = None
+        if self.log_timeout is not None:
+            GLib.source_remove(self.log_timeout)
+            self.log_timeout = None
+
+    def reset(self):
+        with self.lock:
+            self.timings = {}
+            self.counters = {}
+            self.idle_depth_max = self.idle_depth
+            self.since = time.monotonic()
+
+    def record(self, name, elapsed):
+        with self.lock:
+            timing = self.timings.get(name)
+            if timing is None:
+                self.timings[name] = [1, elapsed, elapsed]
+                return
+            timing[0] += 1
+            timing[1] += elapsed
+            if elapsed > timing[2]:
+                timing[2] = elapsed
+
+    def count(self, name, value=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def idle_add(self, callback, *args):
+        # GLib.idle_add for one shot callbacks, counting the ones waiting in the main loop
+        if not self.enabled:
+            return GLib.idle_add(callback, *args)
+        with self.lock:
+            self.idle_depth += 1
+            self.idle_depth_max = max(self.idle_depth, self.idle_depth_max)
+        return GLib.idle_add(self._run_idle, callback, *args)
+
+    def _run_idle(self, callback, *args):
+        with self.lock:
+            self.idle_depth -= 1
+        callback(*args)
+        return False
+
+    def _probe(self, scheduled):
+        # How late the timeout runs is the time the main loop was busy with something else
+        now = time.monotonic()
+        self.record("main_loop.lag", max(0.0, now - scheduled - self.probe_interval / 1000))
+        GLib.idle_add(self._idle_probe, now)
+        self.probe_timeout = GLib.timeout_add(self.probe_interval, self._probe, now)
+        return False
+
+    def _idle_probe(self, scheduled):
+        self.record("main_loop.idle_delay", time.monotonic() - scheduled)
+        return False
+
+    def get_summary(self):
+        with self.lock:
+            elapsed = max(time.monotonic() - self.since, .001)
+            return {
+                "elapsed": elapsed,
+                "idle_depth": self.idle_depth,
+                "idle_depth_max": self.idle_depth_max,
+                "rates": {name: value / elapsed for name, value in self.counters.items()},
+                "timings": {name: list(timing) for name, timing in self.timings.items()},
+            }
+
+    def format_summary(self):
+        summary = self.get_summary()
+        lines = [
+            f"Idle callbacks queued: {summary['idle_depth']} (max {summary['idle_depth_max']})",
+            *(f"{name}: {rate:.1f}/s" for name, rate in sorted(summary['rates'].items())),
+        ]
+        timings = sorted(summary['timings'].items(), key=lambda item: item[1][1], reverse=True)
+        lines.extend(
+            f"{name}: {count} x {total / count * 1000:.2f} ms (max {peak * 1000:.1f} ms)"
+            for name, (count, total, peak) in timings
+        )
+        return lines
+
+    def log(self):
+        logging.info(f"Metrics of the last {self.get_summary()['elapsed']:.0f}s:\n" + "\n".join(self.format_summary()))
+        self.reset()
+        return self.enabled
+
+
+metrics = Metrics()
+
+
+def timed(name):
+    """Records the time spent in the decorated function while the metrics are enabled"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                metrics.record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
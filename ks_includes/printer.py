@@ -1,8 +1,166 @@
+import copy
+import json
 import logging
+import os
+import re
+import threading
 import gi
+from array import array
+from bisect import bisect_left
+from collections import deque
 
 gi.require_version("Gtk", "3.0")
 from gi.repository import GLib
+from ks_includes.metrics import timed
+
+
+class RingBuffer:
+    """Fixed size history with O(1) append
+
+    Every value is written twice into a buffer of double the size,
+    so the last n values are always contiguous and can be returned as a memoryview without copying.
+    The running maximum and minimum are kept in monotonic queues
+    """
+    def __init__(self, size, values=()):
+        self.size = size
+        self.count = 0
+        self._buf = array('d', bytes(16 * size))
+        self._head = 0
+        self._max = deque()
+        self._min = deque()
+        values = [0 if v is None else v for v in list(values)[-size:]]
+        start = size - len(values)
+        self._buf[start:size] = array('d', values)
+        self._buf[start + size:] = array('d', values)
+        for value in self._buf[:size]:
+            self._track(value)
+
+    def __len__(self):
+        return self.size
+
+    def _track(self, value):
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((self.count, value))
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((self.count, value))
+        self.count += 1
+        oldest = self.count - self.size
+        if self._max[0][0] < oldest:
+            self._max.popleft()
+        if self._min[0][0] < oldest:
+            self._min.popleft()
+
+    def append(self, value):
+        self._buf[self._head] = self._buf[self._head + self.size] = value
+        self._head = (self._head + 1) % self.size
+        self._track(value)
+
+    def view(self, results=0):
+        # The view is only valid until the next append
+        end = self._head + self.size
+        if results == 0 or results >= self.size:
+            return memoryview(self._buf)[self._head:end]
+        return memoryview(self._buf)[end - results:end]
+
+    def _extreme(self, queue, results):
+        if results == 0 or results >= self.size:
+            return queue[0][1]
+        first = self.count - results
+        return next(value for index, value in queue if index >= first)
+
+    def max(self, results=0):
+        return self._extreme(self._max, results)
+
+    def min(self, results=0):
+        return self._extreme(self._min, results)
+
+
+class SnapshotStore:
+    """Last known configuration of each printer, used to build the interface before the printer is ready"""
+    def __init__(self, path):
+        self.path = path
+        self.snapshots = self.load()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as file:
+                return json.load(file)
+        except Exception as e:
+            logging.error(f"Unable to load the printer snapshots {self.path}: {e}")
+            return {}
+
+    def get(self, name):
+        return self.snapshots.get(name)
+
+    def save(self, name, snapshot):
+        # The snapshots are not modified once stored so they can be written in a thread
+        self.snapshots = {**self.snapshots, name: snapshot}
+        if self.path:
+            threading.Thread(target=self.write, args=(self.snapshots,), daemon=True).start()
+
+    def write(self, snapshots):
+        try:
+            with open(f"{self.path}.tmp", "w") as file:
+                json.dump(snapshots, file)
+            os.replace(f"{self.path}.tmp", self.path)
+        except Exception as e:
+            logging.error(f"Unable to save the printer snapshots {self.path}: {e}")
+
+
+class MacroCatalog:
+    """The gcode macros of the configuration, parsed once, with an index of the names sorted for prefix searches
+
+    Macros are looked up by name in any case
+    """
+    params_pattern = re.compile(r'params\.(?P<param>..*)\|default\((?P<default>..*)\).*')
+
+    def __init__(self, config, sections, available_commands):
+        self.available_commands = available_commands
+        self.macros = {}
+        self.visible = []
+        self.hidden = []
+        for section in sections:
+            name = section[12:].strip()
+            macro = self.parse(name, config[section])
+            self.macros[name.upper()] = macro
+            if macro['hidden']:
+                self.hidden.append(name)
+            elif not macro['rename_existing'] and name.upper() not in ('LOAD_FILAMENT', 'UNLOAD_FILAMENT'):
+                self.visible.append(name)
+        self.index = sorted(self.macros)
+
+    def parse(self, name, section):
+        params = {}
+        for line in section.get("gcode", "").split("\n"):
+            if line.startswith("{") and "params." in line:
+                result = self.params_pattern.search(line)
+                if result:
+                    params[result["param"]] = result["default"]
+        return {
+            "name": name,
+            "section": section,
+            "hidden": name.startswith("_"),
+            "rename_existing": "rename_existing" in section,
+            "params": params,
+            "description": self.available_commands.get(name.upper(), ""),
+        }
+
+    def get(self, name):
+        return self.macros.get(name.upper())
+
+    def search(self, prefix):
+        # Names of the macros starting with prefix, in alphabetical order
+        prefix = prefix.upper()
+        names = []
+        for key in self.index[bisect_left(self.index, prefix):]:
+            if not key.startswith(prefix):
+                break
+            names.append(self.macros[key]['name'])
+        return names
 
 
 class Printer:
@@ -22,6 +180,8 @@ class Printer:
         self.output_pin_count = 0
         self.store_timeout = None
         self.tempstore = {}
+        self.tempstore_ticks = 0
+        self.tempstore_version = 0
         self.busy_cb = busy_cb
         self.busy = False
         self.tempstore_size = 1200
@@ -31,10 +191,24 @@ class Printer:
         self.temp_devices = self.sensors = None
         self.system_info = {}
         self.warnings = []
+        self.sections = set()
+        self.section_types = {}
+        self.section_index = self.index_sections()
+        self.macro_catalog = None
+        self.version = self.reset_version = 0
+        self.versions = {}
+        self.object_versions = {}
+        self.changed = set()
 
     def reinit(self, printer_info, data):
         self.config = data['configfile']['config']
         self.data = data
+        # Everything is new after a reinit, fields not updated since report this version
+        self.version += 1
+        self.reset_version = self.version
+        self.versions = {}
+        self.object_versions = {}
+        self.changed = set()
         self.devices = {}
         self.tools = []
         self.extrudercount = 0
@@ -43,11 +217,13 @@ class Printer:
         self.ledcount = 0
         self.output_pin_count = 0
         self.tempstore = {}
+        self.tempstore_version += 1
         self.busy = False
         if not self.store_timeout:
             self.store_timeout = GLib.timeout_add_seconds(1, self._update_temp_store)
         self.tempstore_size = 1200
         self.available_commands = {}
+        self.macro_catalog = None
         self.system_info.clear()
         self.warnings = []
 
@@ -103,6 +279,12 @@ class Printer:
                 name = x.split()[1] if len(x.split()) > 1 else x
                 if not name.startswith("_"):
                     self.ledcount += 1
+        self.sections = set(self.config)
+        self.section_types = {}
+        for x in self.config:
+            if " " in x:
+                self.section_types.setdefault(x.split(" ", 1)[0], []).append(x)
+        self.section_index = self.index_sections()
         self.process_update(data)
 
         logging.info(f"Klipper version: {printer_info['software_version']}")
@@ -112,23 +294,60 @@ class Printer:
         logging.info(f"# Output pins: {self.output_pin_count}")
         logging.info(f"# Leds: {self.ledcount}")
 
+    def load_snapshot(self, snapshot):
+        # Builds the devices from the last known configuration, there is no status until the live data arrives
+        self.reinit(snapshot['printer_info'], {"configfile": copy.deepcopy(snapshot['configfile'])})
+        self.available_commands = snapshot['available_commands']
+        self.cameras = snapshot['cameras']
+        self.power_devices = snapshot['power_devices']
+        self.spoolman = snapshot['spoolman']
+        self.state = "not ready"
+
+    @timed("Printer.process_update")
     def process_update(self, data):
+        """Merges a status delta, returns the (object, field) keys whose value changed
+
+        The keys are also kept in self.changed until the next update
+        """
         if self.data is None:
-            return
-        for x in (self.get_temp_devices() + self.get_filament_sensors()):
+            return set()
+        for x in self.section_index['temp_devices'] + self.section_index['filament_sensors']:
             if x in data:
                 for i in data[x]:
                     self.set_dev_stat(x, i, data[x][i])
 
+        version = self.version + 1
+        changed = set()
         for x in data:
             if x == "configfile":
                 continue
             if x not in self.data:
                 self.data[x] = {}
-            self.data[x].update(data[x])
+            current = self.data[x]
+            for field, value in data[x].items():
+                if field not in current or current[field] != value:
+                    current[field] = value
+                    self.versions[(x, field)] = version
+                    self.object_versions[x] = version
+                    changed.add((x, field))
+        if changed:
+            self.version = version
+        self.changed = changed
 
         if "webhooks" in data or "print_stats" in data or "idle_timeout" in data:
             self.process_status_update()
+        return changed
+
+    def get_version(self, obj, field=None):
+        # Version of the last change of the field, or of any field of the object
+        if field is None:
+            return self.object_versions.get(obj, self.reset_version)
+        return self.versions.get((obj, field), self.reset_version)
+
+    def changed_since(self, version, obj, *fields):
+        if not fields:
+            return self.get_version(obj) > version
+        return any(self.get_version(obj, field) > version for field in fields)
 
     def evaluate_state(self):
         # webhooks states: startup, ready, shutdown, error
@@ -184,88 +403,83 @@ class Printer:
         self.cameras = data
         logging.debug(f"Cameras: {self.cameras}")
 
+    def index_sections(self):
+        # Sections of each kind in config order, built once per configuration
+        def of_type(*types):
+            return [x for section_type in types for x in self.section_types.get(section_type, ())]
+        extruders = [x for x in self.tools if not x.startswith('extruder_stepper')]
+        heaters = (["heater_bed"] if "heater_bed" in self.devices else []) \
+            + of_type("heater_generic", "temperature_sensor", "temperature_fan")
+        return {
+            "extruders": extruders,
+            "heaters": heaters,
+            "temp_devices": extruders + heaters,
+            "filament_sensors": of_type("filament_switch_sensor", "filament_motion_sensor"),
+            "fans": (["fan"] if "fan" in self.sections else [])
+            + of_type("controller_fan", "fan_generic", "heater_fan"),
+            "output_pins": of_type("output_pin"),
+            "leds": [x for x in of_type("dotstar", "led", "neopixel", "pca9533", "pca9632")
+                     if not x.split()[1].startswith("_")],
+            "probes": [x for x in ("probe", "bltouch", "smart_effector", "dockable_probe") if x in self.sections],
+            "macros": of_type("gcode_macro"),
+        }
+
     def get_config_section_list(self, search=""):
-        if self.config is not None:
-            return [i for i in list(self.config) if i.startswith(search)] if hasattr(self, "config") else []
-        return []
+        if self.config is None:
+            return []
+        if not search:
+            return list(self.config)
+        if search[-1] == " " and " " not in search[:-1]:
+            return list(self.section_types.get(search[:-1], ()))
+        return [i for i in self.config if i.startswith(search)]
 
     def get_config_section(self, section):
         return self.config[section] if section in self.config else False
 
+    def get_macro_catalog(self):
+        # Built on first use after a reinit, and again once the descriptions of the commands arrive
+        if self.macro_catalog is None or self.macro_catalog.available_commands is not self.available_commands:
+            self.macro_catalog = MacroCatalog(self.config, self.section_index['macros'], self.available_commands)
+        return self.macro_catalog
+
     def get_macro(self, macro):
-        return next(
-            (
-                self.config[key]
-                for key in self.config.keys()
-                if key.find(macro) > -1
-            ),
-            False,
-        )
+        macro = self.get_macro_catalog().get(macro)
+        return macro['section'] if macro else False
 
     def get_fans(self):
-        fans = []
-        if self.config_section_exists("fan"):
-            fans.append("fan")
-        fan_types = ["controller_fan", "fan_generic", "heater_fan"]
-        for fan_type in fan_types:
-            fans.extend(iter(self.get_config_section_list(f"{fan_type} ")))
-        return fans
+        return list(self.section_index['fans'])
 
     def get_output_pins(self):
-        output_pins = []
-        output_pins.extend(iter(self.get_config_section_list("output_pin ")))
-        return output_pins
+        return list(self.section_index['output_pins'])
 
     def get_gcode_macros(self):
-        macros = []
-        for macro in self.get_config_section_list("gcode_macro "):
-            macro = macro[12:].strip()
-            if macro.startswith("_") or macro.upper() in ('LOAD_FILAMENT', 'UNLOAD_FILAMENT'):
-                continue
-            if self.get_macro(macro) and "rename_existing" in self.get_macro(macro):
-                continue
-            macros.append(macro)
-        return macros
+        return list(self.get_macro_catalog().visible)
 
     def get_hidden_gcode_macros(self):
-        macros = []
-        for macro in self.get_config_section_list("gcode_macro "):
-            macro = macro[12:].strip()
-            if macro.startswith("_"):
-                macros.append(macro)
-        return macros
+        return list(self.get_macro_catalog().hidden)
 
     def get_heaters(self):
-        heaters = []
-        if "heater_bed" in self.devices:
-            heaters.append("heater_bed")
-        heaters.extend(iter(self.get_config_section_list("heater_generic ")))
-        heaters.extend(iter(self.get_config_section_list("temperature_sensor ")))
-        heaters.extend(iter(self.get_config_section_list("temperature_fan ")))
-        return heaters
+        return list(self.section_index['heaters'])
 
     def get_filament_sensors(self):
-        sensors = list(self.get_config_section_list("filament_switch_sensor "))
-        sensors.extend(iter(self.get_config_section_list("filament_motion_sensor ")))
-        return sensors
+        return list(self.section_index['filament_sensors'])
 
     def get_probe(self):
-        probe_types = ["probe", "bltouch", "smart_effector", "dockable_probe"]
-        for probe_type in probe_types:
-            if self.config_section_exists(probe_type):
-                logging.info(f"Probe type: {probe_type}")
-                return self.get_config_section(probe_type)
+        if self.section_index['probes']:
+            logging.info(f"Probe type: {self.section_index['probes'][0]}")
+            return self.get_config_section(self.section_index['probes'][0])
         return None
 
     def get_printer_status_data(self):
+        macros = self.get_macro_catalog()
         data = {
             "printer": {
                 "extruders": {"count": self.extrudercount},
                 "temperature_devices": {"count": self.tempdevcount},
                 "fans": {"count": self.fancount},
                 "output_pins": {"count": self.output_pin_count},
-                "gcode_macros": {"count": len(self.get_gcode_macros()), "list": self.get_gcode_macros()},
-                "hidden_gcode_macros": {"count": len(self.get_hidden_gcode_macros()), "list": self.get_hidden_gcode_macros()},
+                "gcode_macros": {"count": len(macros.visible), "list": list(macros.visible)},
+                "hidden_gcode_macros": {"count": len(macros.hidden), "list": list(macros.hidden)},
                 "idle_timeout": self.get_stat("idle_timeout").copy(),
                 "pause_resume": {"is_paused": self.state == "paused"},
                 "power_devices": {"count": len(self.get_power_devices())},
@@ -287,12 +501,7 @@ class Printer:
         return data
 
     def get_leds(self):
-        return [
-            led
-            for led_type in ["dotstar", "led", "neopixel", "pca9533", "pca9632"]
-            for led in self.get_config_section_list(f"{led_type} ")
-            if not led.split()[1].startswith("_")
-        ]
+        return list(self.section_index['leds'])
 
     def get_led_color_order(self, led):
         if led not in self.config or led not in self.data:
@@ -371,48 +580,55 @@ class Printer:
         if section is not False:
             if section not in self.tempstore[device]:
                 return False
-            if results == 0 or results >= len(self.tempstore[device][section]):
-                return self.tempstore[device][section]
-            return self.tempstore[device][section][-results:]
+            return self.tempstore[device][section].view(results)
 
-        temp = {}
-        for section in self.tempstore[device]:
-            if results == 0 or results >= len(self.tempstore[device][section]):
-                temp[section] = self.tempstore[device][section]
-            temp[section] = self.tempstore[device][section][-results:]
-        return temp
+        return {section: self.tempstore[device][section].view(results) for section in self.tempstore[device]}
+
+    def get_temp_store_max(self, device, section, results=0):
+        if device not in self.tempstore or section not in self.tempstore[device]:
+            return None
+        return self.tempstore[device][section].max(results)
 
     def get_temp_devices(self):
-        devices = [
-            device
-            for device in self.tools
-            if not device.startswith('extruder_stepper')
-        ]
-        return devices + self.get_heaters()
+        return list(self.section_index['temp_devices'])
 
     def get_tools(self):
         return self.tools
 
+    @staticmethod
+    def get_config_objects(config):
+        # The tools, heaters, fans, filament sensors, output pins and leds of a configfile, usable before reinit
+        prefixes = ("extruder", "heater_generic ", "temperature_sensor ", "temperature_fan ", "controller_fan ",
+                    "fan_generic ", "heater_fan ", "filament_switch_sensor ", "filament_motion_sensor ",
+                    "output_pin ")
+        leds = ("dotstar ", "led ", "neopixel ", "pca9533 ", "pca9632 ")
+        return [
+            x for x in config
+            if x in ("heater_bed", "fan") or x.startswith(prefixes)
+            or (x.startswith(leds) and not x.split()[1].startswith("_"))
+        ]
+
     def get_tool_number(self, tool):
         return self.tools.index(tool)
 
     def init_temp_store(self, tempstore):
         if self.tempstore and list(self.tempstore) != list(tempstore):
             logging.debug("Tempstore has changed")
-            self.tempstore = tempstore
-            self.change_state(self.state)
+            changed = True
         else:
-            self.tempstore = tempstore
-        for device in self.tempstore:
-            for x in self.tempstore[device]:
-                length = len(self.tempstore[device][x])
-                if length < self.tempstore_size:
-                    for _ in range(1, self.tempstore_size - length):
-                        self.tempstore[device][x].insert(0, 0)
+            changed = False
+        self.tempstore = {
+            device: {x: RingBuffer(self.tempstore_size, tempstore[device][x]) for x in tempstore[device]}
+            for device in tempstore
+        }
+        self.tempstore_ticks = 0
+        self.tempstore_version += 1
+        if changed:
+            self.change_state(self.state)
         logging.info(f"Temp store: {list(self.tempstore)}")
 
     def config_section_exists(self, section):
-        return section in self.get_config_section_list()
+        return section in self.sections
 
     def set_dev_stat(self, dev, stat, value):
         if dev not in self.devices:
@@ -425,11 +641,11 @@ class Printer:
             return False
         for device in self.tempstore:
             for x in self.tempstore[device]:
-                self.tempstore[device][x].pop(0)
                 temp = self.get_dev_stat(device, x[:-1])
                 if temp is None:
                     temp = 0
                 self.tempstore[device][x].append(temp)
+        self.tempstore_ticks += 1
         return True
 
     def enable_spoolman(self):
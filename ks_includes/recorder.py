@@ -0,0 +1,56 @@
+import gzip
+import json
+import logging
+import threading
+import time
+
+
+class WebsocketRecorder:
+    """Writes the websocket traffic to a gzip file of JSON lines: [seconds since the start, kind, payload]
+
+    kind is "init" for the printer state after an initialization, where replays start from,
+    or "ws" for a raw websocket frame as received
+    """
+    flush_interval = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.start = self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+        self.frames = 0
+        try:
+            self.file = gzip.open(path, "wt")
+            logging.info(f"Recording the websocket traffic to {path}")
+        except OSError as e:
+            logging.error(f"Unable to record the websocket traffic to {path}: {e}")
+            self.file = None
+
+    def write(self, kind, payload):
+        now = time.monotonic()
+        line = json.dumps([round(now - self.start, 4), kind, payload], separators=(",", ":"))
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(line + "\n")
+            self.frames += 1
+            if now - self.last_flush > self.flush_interval:
+                self.file.flush()
+                self.last_flush = now
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+                logging.info(f"Recorded {self.frames} frames to {self.path}")
+
+
+def read_recording(path):
+    with gzip.open(path, "rt") as file:
+        try:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        except (EOFError, json.JSONDecodeError):
+            # The recording was not closed, the last lines are lost
+            logging.warning(f"The recording {path} is truncated")
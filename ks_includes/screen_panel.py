@@ -26,6 +26,11 @@ class ScreenPanel:
         self.title = title
         self.devices = {}
         self.active_heaters = []
+        # Printer objects and fields consumed by process_update: {object: [fields] or None for all}
+        # None means that every status update is passed through
+        self.subscriptions = None
+        # Fields left out of the core subscription (positions, LED colors) that the panel still shows
+        self.extra_subscriptions = None
         self.content = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
         self.content.get_style_context().add_class("content")
         self.content.set_hexpand(True)
@@ -46,19 +51,34 @@ class ScreenPanel:
         else:
             self._screen._ws.klippy.emergency_stop()
 
-    def get_file_image(self, filename, width=None, height=None, small=False):
+    def get_thumbnail_source(self, filename, small=False):
         if not self._files.has_thumbnail(filename):
             return None
         loc = self._files.get_thumbnail_location(filename, small)
         if loc is None:
             return None
+        return loc[0], loc[1], self._files.get_file_info(filename)['modified']
+
+    def get_file_image(self, filename, width=None, height=None, small=False):
+        source = self.get_thumbnail_source(filename, small)
+        if source is None:
+            return None
+        width = width if width is not None else self._gtk.img_width
+        height = height if height is not None else self._gtk.img_height
+        return self._screen.thumbnails.load(source, width, height)
+
+    def load_file_image(self, filename, callback, width=None, height=None, small=False, priority=None, group=None):
+        # Like get_file_image but in the background, callback receives the pixbuf or None
+        # returns the key of the request to prioritize it, or None if the callback has already been called
+        source = self.get_thumbnail_source(filename, small)
+        if source is None:
+            callback(None)
+            return None
         width = width if width is not None else self._gtk.img_width
         height = height if height is not None else self._gtk.img_height
-        if loc[0] == "file":
-            return self._gtk.PixbufFromFile(loc[1], width, height)
-        if loc[0] == "http":
-            return self._gtk.PixbufFromHttp(loc[1], width, height)
-        return None
+        thumbnails = self._screen.thumbnails
+        priority = priority if priority is not None else thumbnails.BACKGROUND
+        return thumbnails.request(source, width, height, callback, priority, group)
 
     def menu_item_clicked(self, widget, item):
         if 'extra' in item:
@@ -0,0 +1,222 @@
+import hashlib
+import heapq
+import itertools
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import gi
+
+gi.require_version("Gtk", "3.0")
+from gi.repository import GdkPixbuf, GLib
+from ks_includes import functions
+
+
+class ThumbnailCache:
+    """Scaled thumbnails kept in memory (LRU within a byte budget) and as PNG files on disk
+
+    Keys are (source, width, height) where source is (location type, path, modified) so a new upload is a new key
+    """
+    def __init__(self, path, memory_budget, disk_budget):
+        self.path = path
+        self.memory = OrderedDict()
+        self.memory_used = 0
+        self.memory_budget = memory_budget
+        self.disk_used = None
+        self.disk_budget = disk_budget
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            pixbuf = self.memory.get(key)
+            if pixbuf is not None:
+                self.memory.move_to_end(key)
+            return pixbuf
+
+    def put(self, key, pixbuf):
+        size = pixbuf.get_byte_length()
+        with self.lock:
+            if key in self.memory:
+                self.memory_used -= self.memory.pop(key).get_byte_length()
+            if size > self.memory_budget:
+                return
+            self.memory[key] = pixbuf
+            self.memory_used += size
+            while self.memory_used > self.memory_budget:
+                self.memory_used -= self.memory.popitem(last=False)[1].get_byte_length()
+
+    def get_filename(self, key):
+        return os.path.join(self.path, f"{hashlib.sha1(repr(key).encode()).hexdigest()}.png")
+
+    def load(self, key):
+        if not self.path:
+            return None
+        filename = self.get_filename(key)
+        if not os.path.exists(filename):
+            return None
+        try:
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file(filename)
+            # The modification time is used as the last access for pruning
+            os.utime(filename)
+            return pixbuf
+        except Exception as e:
+            logging.error(f"Unable to load cached thumbnail {filename}: {e}")
+            return None
+
+    def save(self, key, pixbuf):
+        if not self.path:
+            return
+        filename = self.get_filename(key)
+        try:
+            pixbuf.savev(f"{filename}.tmp", "png", [], [])
+            os.replace(f"{filename}.tmp", filename)
+            size = os.path.getsize(filename)
+        except Exception as e:
+            logging.error(f"Unable to save cached thumbnail {filename}: {e}")
+            return
+        with self.lock:
+            if self.disk_used is None:
+                self.disk_used = sum(entry.stat().st_size for entry in os.scandir(self.path) if entry.is_file())
+            else:
+                self.disk_used += size
+            if self.disk_used > self.disk_budget:
+                self.prune()
+
+    def prune(self):
+        # Removes the least recently used files until the cache is under 3/4 of the budget
+        entries = sorted((entry for entry in os.scandir(self.path) if entry.is_file()),
+                         key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if self.disk_used <= self.disk_budget * .75:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self.disk_used -= size
+            except OSError as e:
+                logging.error(f"Unable to remove cached thumbnail {entry.path}: {e}")
+        logging.debug(f"Thumbnail cache pruned to {self.disk_used} bytes")
+
+
+class ThumbnailLoader:
+    """Fetches and decodes thumbnails in a pool of worker threads
+
+    Requests are served by priority, lower first, the pixbuf (or None) is handed to the callbacks in the main thread
+    the results are kept in a ThumbnailCache
+    """
+    VISIBLE = 0
+    BACKGROUND = 1
+
+    def __init__(self, screen, workers=2):
+        self._screen = screen
+        self.workers = workers
+        self.threads = []
+        self.queue = []
+        self.pending = {}
+        self.counter = itertools.count()
+        self.lock = threading.Condition()
+        config = screen._config.get_main_config()
+        disk_budget = config.getint("thumbnail_disk_cache", 64) * 1024 * 1024
+        self.cache = ThumbnailCache(
+            functions.get_data_dir("thumbnails") if disk_budget > 0 else None,
+            config.getint("thumbnail_memory_cache", 16) * 1024 * 1024,
+            disk_budget
+        )
+
+    def load(self, source, width, height):
+        # Synchronous, for single images on demand
+        key = (source, int(width), int(height))
+        pixbuf = self.cache.get(key)
+        if pixbuf is None:
+            pixbuf = self._load(key)
+            if pixbuf is not None:
+                self.cache.put(key, pixbuf)
+        return pixbuf
+
+    def request(self, source, width, height, callback, priority=BACKGROUND, group=None):
+        key = (source, int(width), int(height))
+        pixbuf = self.cache.get(key)
+        if pixbuf is not None:
+            callback(pixbuf)
+            return None
+        with self.lock:
+            if key in self.pending:
+                req = self.pending[key]
+                if callback not in req['callbacks']:
+                    req['callbacks'].append(callback)
+                req['group'] = group
+                if priority < req['priority'] and not req['running']:
+                    self._push(key, priority)
+                return key
+            self.pending[key] = {'callbacks': [callback], 'priority': priority, 'group': group, 'running': False}
+            self._push(key, priority)
+            if len(self.threads) < self.workers:
+                thread = threading.Thread(target=self._worker, daemon=True)
+                self.threads.append(thread)
+                thread.start()
+            self.lock.notify()
+        return key
+
+    def prioritize(self, keys, priority=VISIBLE):
+        # Moves these pending requests ahead of the queue
+        with self.lock:
+            for key in keys:
+                req = self.pending.get(key)
+                if req is not None and not req['running'] and priority < req['priority']:
+                    self._push(key, priority)
+
+    def cancel(self, group):
+        # Drops the requests of the group, the ones already being fetched are discarded when they finish
+        with self.lock:
+            for key in [key for key, req in self.pending.items() if req['group'] == group]:
+                del self.pending[key]
+
+    def _push(self, key, priority):
+        # Entries superseded by a better priority stay in the heap and are skipped when popped
+        self.pending[key]['priority'] = priority
+        heapq.heappush(self.queue, (priority, next(self.counter), key))
+
+    def _next(self):
+        with self.lock:
+            while True:
+                while self.queue:
+                    priority, _, key = heapq.heappop(self.queue)
+                    req = self.pending.get(key)
+                    if req is not None and not req['running'] and req['priority'] == priority:
+                        req['running'] = True
+                        return key, req
+                self.lock.wait()
+
+    def _load(self, key):
+        pixbuf = self.cache.load(key)
+        if pixbuf is not None:
+            return pixbuf
+        (kind, path, modified), width, height = key
+        try:
+            if kind == "file":
+                pixbuf = self._screen.gtk.PixbufFromFile(path, width, height)
+            else:
+                pixbuf = self._screen.gtk.PixbufFromHttp(path, width, height)
+        except Exception as e:
+            logging.exception(e)
+            return None
+        if pixbuf is not None:
+            self.cache.save(key, pixbuf)
+        return pixbuf
+
+    def _worker(self):
+        while True:
+            key, req = self._next()
+            GLib.idle_add(self._deliver, key, req, self._load(key))
+
+    def _deliver(self, key, req, pixbuf):
+        if pixbuf is not None:
+            self.cache.put(key, pixbuf)
+        with self.lock:
+            if self.pending.get(key) is not req:
+                return False
+            del self.pending[key]
+        for callback in req['callbacks']:
+            callback(pixbuf)
+        return False
@@ -2,10 +2,55 @@ import datetime
 import logging
 import math
 
+import cairo
 import gi
 
 gi.require_version("Gtk", "3.0")
 from gi.repository import Gdk, Gtk
+from ks_includes.metrics import timed
+
+
+class SeriesDecimator:
+    """Min/max bucket reduction of a series to about two points per pixel column
+
+    Buckets are aligned to the sample count, so the completed ones are cached
+    and only the buckets at the edges of the window are computed again when the history advances
+    """
+    def __init__(self):
+        self.key = None
+        self.buckets = {}
+
+    def reduce(self, data, ticks, columns, version):
+        length = len(data)
+        per_bucket = math.ceil(length / columns) if columns > 0 else 1
+        if per_bucket <= 1:
+            return None, data
+        key = (version, length, per_bucket)
+        if key != self.key:
+            self.key = key
+            self.buckets = {}
+        first = ticks - length
+        first_bucket = first // per_bucket
+        for bucket in [b for b in self.buckets if b < first_bucket]:
+            del self.buckets[bucket]
+        indexes = []
+        values = []
+        for bucket in range(first_bucket, (ticks - 1) // per_bucket + 1):
+            start = max(bucket * per_bucket, first)
+            end = min((bucket + 1) * per_bucket, ticks)
+            complete = start == bucket * per_bucket and end == (bucket + 1) * per_bucket
+            points = self.buckets.get(bucket) if complete else None
+            if points is None:
+                chunk = data[start - first:end - first]
+                low = min(range(len(chunk)), key=chunk.__getitem__)
+                high = max(range(len(chunk)), key=chunk.__getitem__)
+                points = [(start + i, chunk[i]) for i in sorted({low, high})]
+                if complete:
+                    self.buckets[bucket] = points
+            for index, value in points:
+                indexes.append(index - first)
+                values.append(value)
+        return indexes, values
 
 
 class HeaterGraph(Gtk.DrawingArea):
@@ -23,6 +68,12 @@ class HeaterGraph(Gtk.DrawingArea):
         self.connect('touch-event', self.event_cb)
         self.connect('button_press_event', self.event_cb)
         self.font_size = round(font_size * 0.75)
+        # Offscreen layers: the static frame and grid, and the plot which is scrolled as samples arrive
+        self.static = self.plot = None
+        self.static_key = self.plot_key = None
+        self.hscale = 1
+        self.plot_ticks = self.plot_base = self.plot_shift = 0
+        self.decimators = {}
 
     def add_object(self, name, ev_type, rgb=None, dashed=False, fill=False):
         if rgb is None:
@@ -34,6 +85,7 @@ class HeaterGraph(Gtk.DrawingArea):
             "fill": fill,
             "rgb": rgb
         }})
+        self.plot_key = None
 
     @staticmethod
     def event_cb(da, ev):
@@ -51,14 +103,25 @@ class HeaterGraph(Gtk.DrawingArea):
         mnum = [0]
         for device in self.store:
             if self.store[device]['show']:
-                temp = self.printer.get_temp_store(device, "temperatures", data_points)
-                if temp:
-                    mnum.append(max(temp))
-                target = self.printer.get_temp_store(device, "targets", data_points)
-                if target:
-                    mnum.append(max(target))
+                for section in ("temperatures", "targets"):
+                    value = self.printer.get_temp_store_max(device, section, data_points)
+                    if value is not None:
+                        mnum.append(value)
         return max(mnum)
 
+    @staticmethod
+    def new_layer(ctx, width, height):
+        surface = ctx.get_target().create_similar(cairo.Content.COLOR_ALPHA, width, height)
+        layer = cairo.Context(surface)
+        layer.set_font_options(ctx.get_font_options())
+        return surface, layer
+
+    @staticmethod
+    def clip_plot(ctx, gsize):
+        ctx.rectangle(gsize[0][0], gsize[0][1], gsize[1][0] - gsize[0][0], gsize[1][1] - gsize[0][1])
+        ctx.clip()
+
+    @timed("HeaterGraph.draw_graph")
     def draw_graph(self, da, ctx):
         width = da.get_allocated_width()
         height = da.get_allocated_height()
@@ -68,20 +131,6 @@ class HeaterGraph(Gtk.DrawingArea):
         g_height_start = 10
         g_height = height - self.font_size * 2
 
-        ctx.set_source_rgb(.5, .5, .5)
-        ctx.set_line_width(1)
-        ctx.set_tolerance(0.1)
-
-        ctx.move_to(g_width_start, g_height_start)
-        ctx.line_to(g_width, g_height_start)
-        ctx.line_to(g_width, g_height)
-        ctx.line_to(g_width_start, g_height)
-        ctx.line_to(g_width_start, g_height_start)
-        ctx.stroke()
-
-        ctx.set_source_rgb(1, 0, 0)
-        ctx.move_to(g_width_start, height)
-
         gsize = [
             [g_width_start, g_height_start],
             [g_width, g_height]
@@ -90,51 +139,116 @@ class HeaterGraph(Gtk.DrawingArea):
         self.max_length = self.get_max_length()
         graph_width = gsize[1][0] - gsize[0][0]
         points_per_pixel = self.max_length / graph_width
-        data_points = int(round(graph_width * points_per_pixel, 0))
-        max_num = math.ceil(self.get_max_num(data_points) * 1.1 / 10) * 10
         if points_per_pixel == 0:
             return
-        d_width = 1 / points_per_pixel
+        max_num = math.ceil(self.get_max_num(self.max_length) * 1.1 / 10) * 10
+
+        static_key = (width, height, max_num)
+        if self.static is None or static_key != self.static_key:
+            self.static, layer = self.new_layer(ctx, width, height)
+            self.graph_frame(layer, gsize)
+            self.hscale = self.graph_lines(layer, gsize, max_num)
+            self.static_key = static_key
+        ctx.set_source_surface(self.static, 0, 0)
+        ctx.paint()
 
-        d_height_scale = self.graph_lines(ctx, gsize, max_num)
         self.graph_time(ctx, gsize, points_per_pixel)
+        self.update_plot(ctx, width, height, gsize, max_num)
+        ctx.set_source_surface(self.plot, 0, 0)
+        ctx.paint()
 
-        for name in self.store:
-            if not self.store[name]['show']:
-                continue
-            for dev_type in self.store[name]:
-                d = self.printer.get_temp_store(name, dev_type, data_points)
-                if d is False:
+    def update_plot(self, ctx, width, height, gsize, max_num):
+        length = self.max_length
+        step = (gsize[1][0] - gsize[0][0] - 2) / max(length - 1, 1)
+        ticks = self.printer.tempstore_ticks
+        key = (width, height, max_num, length, self.printer.tempstore_version,
+               tuple(name for name in self.store if self.store[name]['show']))
+        new = ticks - self.plot_ticks
+        if self.plot is None or key != self.plot_key or not 0 <= new < length:
+            self.plot, layer = self.new_layer(ctx, width, height)
+            self.clip_plot(layer, gsize)
+            columns = int(gsize[1][0] - gsize[0][0])
+            for name, dev_type in self.get_series():
+                data = self.printer.get_temp_store(name, dev_type, length)
+                if data is False:
                     continue
-                self.graph_data(ctx, d, gsize, d_height_scale, d_width, self.store[name][dev_type]["rgb"],
-                                self.store[name][dev_type]["dashed"], self.store[name][dev_type]["fill"])
+                if (name, dev_type) not in self.decimators:
+                    self.decimators[(name, dev_type)] = SeriesDecimator()
+                # ticks counts the samples added since the store was loaded, it keeps the buckets aligned as it scrolls
+                indexes, data = self.decimators[(name, dev_type)].reduce(
+                    data, ticks + length, columns, self.printer.tempstore_version)
+                self.graph_data(layer, data, gsize, self.hscale, step, indexes=indexes, **self.store[name][dev_type])
+            self.plot_key = key
+            self.plot_base = self.plot_ticks = ticks
+            self.plot_shift = 0
+            return
+        if new == 0:
+            return
+        # Scroll the existing plot by whole pixels and draw only the new samples
+        # the fraction of a pixel that was not scrolled is added to the position of the new samples
+        exact = (ticks - self.plot_base) * step
+        shift = int(exact) - self.plot_shift
+        plot, layer = self.new_layer(ctx, width, height)
+        self.clip_plot(layer, gsize)
+        layer.set_source_surface(self.plot, -shift, 0)
+        layer.paint()
+        self.plot_shift += shift
+        for name, dev_type in self.get_series():
+            data = self.printer.get_temp_store(name, dev_type, new + 1)
+            if data is False:
+                continue
+            self.graph_data(layer, data, gsize, self.hscale, step, start=length - new - 1,
+                            offset=exact - int(exact), dash_offset=self.plot_shift, **self.store[name][dev_type])
+        self.plot = plot
+        self.plot_ticks = ticks
+
+    def get_series(self):
+        return [
+            (name, dev_type)
+            for name in self.store if self.store[name]['show']
+            for dev_type in self.store[name] if dev_type != "show"
+        ]
 
     @staticmethod
-    def graph_data(ctx, data, gsize, hscale, swidth, rgb, dashed=False, fill=False):
-        i = 0
+    def graph_frame(ctx, gsize):
+        ctx.set_source_rgb(.5, .5, .5)
+        ctx.set_line_width(1)
+        ctx.set_tolerance(0.1)
+
+        ctx.move_to(gsize[0][0], gsize[0][1])
+        ctx.line_to(gsize[1][0], gsize[0][1])
+        ctx.line_to(gsize[1][0], gsize[1][1])
+        ctx.line_to(gsize[0][0], gsize[1][1])
+        ctx.line_to(gsize[0][0], gsize[0][1])
+        ctx.stroke()
+
+    @staticmethod
+    def graph_data(ctx, data, gsize, hscale, swidth, rgb, dashed=False, fill=False, start=0, offset=0,
+                   dash_offset=0, indexes=None):
+        # indexes are the positions of the values in the series when it has been decimated
         ctx.set_source_rgba(rgb[0], rgb[1], rgb[2], 1)
-        ctx.move_to(gsize[0][0] + 1, gsize[0][1] - 1)
+        ctx.set_line_width(1)
+        ctx.set_tolerance(0.1)
+        origin = gsize[0][0] + 1 + start * swidth + offset
+        first = p_x = origin if indexes is None else origin + indexes[0] * swidth
         if dashed:
-            ctx.set_dash([10, 5])
+            ctx.set_dash([10, 5], (first - gsize[0][0] - 1 + dash_offset) % 15)
         else:
             ctx.set_dash([1, 0])
-        d_len = len(data) - 1
-        for d in data:
-            p_x = i * swidth + gsize[0][0] if i != d_len else gsize[1][0] - 1
+        for i, d in enumerate(data):
+            p_x = origin + (i if indexes is None else indexes[i]) * swidth
             p_y = max(gsize[0][1], min(gsize[1][1], gsize[1][1] - 1 - (d * hscale)))
             if i == 0:
-                ctx.move_to(gsize[0][0] + 1, p_y)
-                i += 1
+                ctx.move_to(p_x, p_y)
                 continue
             ctx.line_to(p_x, p_y)
-            i += 1
         if fill is False:
             ctx.stroke()
             return
 
         ctx.stroke_preserve()
-        ctx.line_to(gsize[1][0] - 1, gsize[1][1] - 1)
-        ctx.line_to(gsize[0][0] + 1, gsize[1][1] - 1)
+        ctx.line_to(p_x, gsize[1][1] - 1)
+        ctx.line_to(first, gsize[1][1] - 1)
         if fill:
             ctx.set_source_rgba(rgb[0], rgb[1], rgb[2], .1)
             ctx.fill()
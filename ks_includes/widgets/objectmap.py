@@ -4,6 +4,7 @@ import gi
 
 gi.require_version("Gtk", "3.0")
 from gi.repository import Gdk, Gtk
+from ks_includes.metrics import timed
 
 
 class ObjectMap(Gtk.DrawingArea):
@@ -68,6 +69,7 @@ class ObjectMap(Gtk.DrawingArea):
             script
         )
 
+    @timed("ObjectMap.draw_graph")
     def draw_graph(self, da, ctx):
         right = da.get_allocated_width() - self.margin_right
         bottom = da.get_allocated_height() - self.margin_bottom
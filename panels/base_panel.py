@@ -21,6 +21,7 @@ class BasePanel(ScreenPanel):
         self.titlebar_items = []
         self.titlebar_name_type = None
         self.current_extruder = None
+        self.temp_version = -1
         self.last_usage_report = datetime.now()
         self.usage_report = 0
         # Action bar buttons
@@ -96,6 +97,12 @@ class BasePanel(ScreenPanel):
         self.titlebar.set_valign(Gtk.Align.CENTER)
         self.titlebar.add(self.control['temp_box'])
         self.titlebar.add(self.titlelbl)
+        # Shown while the interface is built from the last known configuration
+        self.labels['stale'] = Gtk.Label()
+        self.labels['stale'].set_ellipsize(Pango.EllipsizeMode.END)
+        self.labels['stale'].get_style_context().add_class("message_popup_warning")
+        self.labels['stale'].set_no_show_all(True)
+        self.titlebar.add(self.labels['stale'])
         self.titlebar.add(self.control['ipaddr_box'])
 
         # Main layout
@@ -119,10 +126,13 @@ class BasePanel(ScreenPanel):
             for child in self.control['temp_box'].get_children():
                 self.control['temp_box'].remove(child)
             devices = self._printer.get_temp_devices()
+            self.subscriptions = {device: ["temperature"] for device in devices}
+            self.subscriptions["toolhead"] = ["extruder"]
             if not show or not devices:
                 return
 
             img_size = self._gtk.img_scale * self.bts
+            self.temp_version = -1
             for device in devices:
                 self.labels[device] = Gtk.Label(ellipsize=Pango.EllipsizeMode.START)
                 self.labels[f'{device}_box'] = Gtk.Box()
@@ -259,9 +269,14 @@ class BasePanel(ScreenPanel):
 
         if action != "notify_status_update" or self._screen.printer is None:
             return
+        # Panels only receive the fields that changed (the whole status when attached),
+        # redraw the temperatures that changed since the last redraw
+        version, self.temp_version = self.temp_version, self._printer.version
         devices = (self._printer.get_temp_devices())
         if devices is not None:
             for device in devices:
+                if not self._printer.changed_since(version, device, "temperature"):
+                    continue
                 temp = self._printer.get_dev_stat(device, "temperature")
                 if temp is not None and device in self.labels:
                     name = ""
@@ -299,6 +314,13 @@ class BasePanel(ScreenPanel):
         self.control['shortcut'].set_visible(show)
         self.set_control_sensitive(self._screen._cur_panels[-1] != self.shorcut['panel'])
 
+    def set_stale(self, msg):
+        if msg is None:
+            self.labels['stale'].hide()
+            return
+        self.labels['stale'].set_label(" ".join(msg.split()))
+        self.labels['stale'].show()
+
     def show_printer_select(self, show=True):
         self.control['printer_select'].set_visible(show)
 
@@ -55,7 +55,7 @@ class Panel(ScreenPanel):
         grid = self._gtk.HomogeneousGrid()
         grid.attach(self.buttons['dm'], 0, 0, 1, 1)
 
-        if "screws_tilt_adjust" in self._printer.get_config_section_list():
+        if self._printer.config_section_exists("screws_tilt_adjust"):
             self.buttons['screws'] = self._gtk.Button("refresh", _("Screws Adjust"), "color4")
             self.buttons['screws'].connect("clicked", self.screws_tilt_calculate)
             grid.attach(self.buttons['screws'], 0, 1, 1, 1)
@@ -80,7 +80,7 @@ class Panel(ScreenPanel):
 
             self.screws = new_screws
             logging.info(f"screws with offset: {self.screws}")
-        elif "bed_screws" in self._printer.get_config_section_list():
+        elif self._printer.config_section_exists("bed_screws"):
             self.screws = self._get_screws("bed_screws")
             logging.info(f"bed_screws: {self.screws}")
 
@@ -1,4 +1,3 @@
-import mpv
 import logging
 import gi
 import threading
@@ -73,6 +72,8 @@ class Panel(ScreenPanel):
 
         if self.mpv:
             self.mpv.terminate()
+        # Imported on use, loading libmpv is slow
+        import mpv
         self.mpv = mpv.MPV(fullscreen=True, log_handler=self.log, vo='gpu,wlshm,xv,x11')
 
         self.mpv.vf = vf
@@ -6,6 +6,7 @@ from ks_includes.screen_panel import ScreenPanel
 class Panel(ScreenPanel):
     def __init__(self, screen, title):
         super().__init__(screen, title)
+        self.extra_subscriptions = {"gcode_move": ["gcode_position"]}
         self.nozzle_height_difference = None
         self.update_nozzle_height_difference()
         logging.info(f"nozzle height difference: {self.nozzle_height_difference}")
@@ -16,6 +16,7 @@ class Panel(ScreenPanel):
 
     def __init__(self, screen, title):
         super().__init__(screen, title)
+        self.extra_subscriptions = {"toolhead": ["position"]}
         self.settings = {}
         self.pos = {}
         self.is_home = False
@@ -15,6 +15,7 @@ class Panel(ScreenPanel):
     step_index = 0
     def __init__(self, screen, title):
         super().__init__(screen, title)
+        self.extra_subscriptions = {"gcode_move": ["gcode_position"]}
         self.z_offset = None
         if self._screen.klippy_config is not None:
             try:
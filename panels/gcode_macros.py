@@ -1,5 +1,4 @@
 import logging
-import re
 import gi
 
 gi.require_version("Gtk", "3.0")
@@ -17,8 +16,15 @@ class Panel(ScreenPanel):
         self.sort_btn.get_style_context().add_class("buttons_slim")
         self.options = {}
         self.macros = {}
+        self.catalog = None
         self.menu = ['macros_menu']
 
+        self.search = Gtk.Entry(placeholder_text=_("Search"))
+        self.search.set_hexpand(True)
+        self.search.connect("changed", self.filter_macros)
+        self.search.connect("focus-in-event", self._screen.show_keyboard)
+        self.search.connect("focus-out-event", self._screen.remove_keyboard)
+
         adjust = self._gtk.Button("settings", " " + _("Settings"), "color2", self.bts, Gtk.PositionType.LEFT, 1)
         adjust.get_style_context().add_class("buttons_slim")
         adjust.connect("clicked", self.load_menu, 'options', _("Settings"))
@@ -27,6 +33,7 @@ class Panel(ScreenPanel):
         sbox = Gtk.Box()
         sbox.set_vexpand(False)
         sbox.pack_start(self.sort_btn, True, True, 5)
+        sbox.pack_start(self.search, True, True, 5)
         sbox.pack_start(adjust, True, True, 5)
 
         self.labels['macros_list'] = self._gtk.ScrolledWindow()
@@ -48,18 +55,20 @@ class Panel(ScreenPanel):
             self.unload_menu()
         self.reload_macros()
 
+    def process_update(self, action, data):
+        # The catalog is replaced after a restart and once the descriptions arrive
+        if self.catalog is not None and self._printer.get_macro_catalog() is not self.catalog:
+            self.reload_macros()
+
     def add_gcode_macro(self, macro):
-        section = self._printer.get_macro(macro)
-        if section:
-            if "rename_existing" in section:
-                return
-            if "gcode" in section:
-                gcode = section["gcode"].split("\n")
-            else:
-                logging.error(f"gcode not found in {macro}\n{section}")
-                return
-        else:
-            logging.debug(f"Couldn't load {macro}\n{section}")
+        info = self._printer.get_macro_catalog().get(macro)
+        if info is None:
+            logging.debug(f"Couldn't load {macro}")
+            return
+        if info['rename_existing']:
+            return
+        if "gcode" not in info['section']:
+            logging.error(f"gcode not found in {macro}\n{info['section']}")
             return
         name = Gtk.Label()
         name.set_markup(f"<big><b>{macro}</b></big>")
@@ -77,6 +86,9 @@ class Panel(ScreenPanel):
 
         labels = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
         labels.add(name)
+        if info['description']:
+            description = Gtk.Label(label=info['description'], halign=Gtk.Align.START, wrap=True)
+            labels.add(description)
 
         row = Gtk.Box(spacing=5)
         row.get_style_context().add_class("frame-item")
@@ -85,18 +97,8 @@ class Panel(ScreenPanel):
 
         self.macros[macro] = {
             "row": row,
-            "params": {},
+            "params": {param: Gtk.Entry(placeholder_text=default) for param, default in info['params'].items()},
         }
-        pattern = r'params\.(?P<param>..*)\|default\((?P<default>..*)\).*'
-        i = 0
-        for line in gcode:
-            if line.startswith("{") and "params." in line:
-                result = re.search(pattern, line)
-                if result:
-                    result = result.groupdict()
-                    default = result["default"] if "default" in result else ""
-                    entry = Gtk.Entry(placeholder_text=default)
-                    self.macros[macro]["params"].update({result["param"]: entry})
 
         for param in self.macros[macro]["params"]:
             labels.add(Gtk.Label(param))
@@ -128,6 +130,7 @@ class Panel(ScreenPanel):
         self.macros = {}
         self.options = {}
         self.labels['options'].remove_column(0)
+        self.catalog = self._printer.get_macro_catalog()
         self.load_gcode_macros()
         return False
 
@@ -144,11 +147,23 @@ class Panel(ScreenPanel):
         for macro in list(self.options):
             self.add_option('options', self.options, macro, self.options[macro])
         macros = sorted(self.macros, reverse=self.sort_reverse, key=str.casefold)
-        for macro in macros:
-            pos = macros.index(macro)
+        for pos, macro in enumerate(macros):
             self.labels['macros'].insert_row(pos)
             self.labels['macros'].attach(self.macros[macro]['row'], 0, pos, 1, 1)
-            self.labels['macros'].show_all()
+        self.labels['macros'].show_all()
+        self.filter_macros()
+
+    def filter_macros(self, widget=None):
+        prefix = self.search.get_text().strip()
+        matches = set(self._printer.get_macro_catalog().search(prefix)) if prefix else None
+        for macro in self.macros:
+            show = matches is None or macro in matches
+            # Hidden rows stay hidden when the panel is shown with show_all
+            self.macros[macro]['row'].set_no_show_all(not show)
+            if show:
+                self.macros[macro]['row'].show_all()
+            else:
+                self.macros[macro]['row'].hide()
 
     def add_option(self, boxname, opt_array, opt_name, option):
         name = Gtk.Label()
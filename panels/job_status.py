@@ -18,8 +18,8 @@ class Panel(ScreenPanel):
         super().__init__(screen, title)
         self.grid = self._gtk.HomogeneousGrid()
         self.grid.set_row_homogeneous(False)
-        for extruder in self._printer.get_tools():
-            self._screen.manual_settings[extruder] = {"extruder_temp": 0.0, "speedfactor": 0.0, "extrudefactor": 0.0, "zoffset": 99.0}        
+        # The panel can be built in idle time before the print, the print starts on the first show
+        self.print_started = False
         self.pos_z = 0.0
         self.extrusion = 100
         self.speed_factor = 1.0
@@ -145,7 +145,20 @@ class Panel(ScreenPanel):
         self.switch_info(info=self.status_grid)
         self.content.add(self.grid)
 
+        self.subscriptions = {device: ["temperature", "target", "power"] for device in self._printer.get_temp_devices()}
+        self.subscriptions.update({fan: ["speed"] for fan in self.fans})
+        self.subscriptions["extruder"] = ["temperature", "target", "power", "pressure_advance"]
+        self.subscriptions.update({
+            "display_status": ["message"],
+            "toolhead": ["extruder", "max_accel"],
+            "gcode_move": ["gcode_position", "extrude_factor", "speed_factor", "speed", "homing_origin"],
+            "motion_report": None,
+            "print_stats": None,
+        })
+
     def create_status_grid(self, widget=None):
+        # The new labels show every device on the next update
+        self.temp_version = -1
         buttons = {
             'speed': self._gtk.Button("speed+", "-", None, self.bts, Gtk.PositionType.LEFT, 1),
             'z': self._gtk.Button("home-z", "-", None, self.bts, Gtk.PositionType.LEFT, 1),
@@ -359,7 +372,19 @@ class Panel(ScreenPanel):
         ctx.arc(0, 0, r, 3 / 2 * pi, 3 / 2 * pi + (self.progress * 2 * pi))
         ctx.stroke()
 
+    def start_print(self):
+        if self.print_started:
+            return
+        self.print_started = True
+        for extruder in self._printer.get_tools():
+            self._screen.manual_settings[extruder] = {"extruder_temp": 0.0, "speedfactor": 0.0, "extrudefactor": 0.0, "zoffset": 99.0}
+        extruder = self._printer.get_stat("toolhead", "extruder")
+        if extruder:
+            diameter = float(self._printer.get_config_section(extruder)['filament_diameter'])
+            self.fila_section = pi * ((diameter / 2) ** 2)
+
     def activate(self):
+        self.start_print()
         if self.flow_timeout is None:
             self.flow_timeout = GLib.timeout_add_seconds(2, self.update_flow)
 
@@ -586,6 +611,8 @@ class Panel(ScreenPanel):
         self.update_progress(0.0)
 
     def process_update(self, action, data):
+        # The first update of a show comes before activate
+        self.start_print()
         if action == "notify_gcode_response":
             if "action:cancel" in data:
                 self.set_state("cancelled")
@@ -597,8 +624,10 @@ class Panel(ScreenPanel):
         elif action != "notify_status_update":
             return
 
+        # Full status updates are sent when the panel is shown, only the devices that changed are redrawn
+        version, self.temp_version = self.temp_version, self._printer.version
         for x in self._printer.get_temp_devices():
-            if x in data:
+            if x in data and self._printer.changed_since(version, x):
                 self.update_temp(
                     x,
                     self._printer.get_dev_stat(x, "temperature"),
@@ -12,6 +12,7 @@ class Panel(ScreenPanel):
 
     def __init__(self, screen, title):
         super().__init__(screen, title)
+        self.extra_subscriptions = {led: ["color_data"] for led in self._printer.get_leds()}
         self.da_size = self._gtk.img_scale * 2
         self.preview = Gtk.DrawingArea(width_request=self.da_size, height_request=self.da_size)
         self.preview.set_size_request(-1, self.da_size * 2)
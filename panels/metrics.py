@@ -0,0 +1,54 @@
+import gi
+
+gi.require_version("Gtk", "3.0")
+from gi.repository import Gtk, GLib
+from ks_includes.metrics import metrics
+from ks_includes.screen_panel import ScreenPanel
+
+
+class Panel(ScreenPanel):
+    def __init__(self, screen, title):
+        super().__init__(screen, title)
+        self.refresh_timeout = None
+        self.collecting = False
+        self.tb = Gtk.TextBuffer()
+        tv = Gtk.TextView(editable=False, cursor_visible=False, wrap_mode=Gtk.WrapMode.WORD_CHAR)
+        tv.set_buffer(self.tb)
+
+        scroll = Gtk.ScrolledWindow()
+        scroll.set_hexpand(True)
+        scroll.set_vexpand(True)
+        scroll.add(tv)
+
+        reset = self._gtk.Button("refresh", _('Reset') + " ", None, self.bts, Gtk.PositionType.RIGHT, 1)
+        reset.connect("clicked", self.reset)
+        reset.set_hexpand(False)
+        reset.set_halign(Gtk.Align.END)
+
+        self.content.add(reset)
+        self.content.add(scroll)
+
+    def activate(self):
+        # Collects only while the panel is shown, unless the metrics are enabled in the config
+        if not metrics.enabled:
+            metrics.start()
+            self.collecting = True
+        self.refresh()
+        if self.refresh_timeout is None:
+            self.refresh_timeout = GLib.timeout_add_seconds(1, self.refresh)
+
+    def deactivate(self):
+        if self.refresh_timeout is not None:
+            GLib.source_remove(self.refresh_timeout)
+            self.refresh_timeout = None
+        if self.collecting:
+            metrics.stop()
+            self.collecting = False
+
+    def reset(self, widget=None):
+        metrics.reset()
+        self.refresh()
+
+    def refresh(self):
+        self.tb.set_text("\n".join(metrics.format_summary()))
+        return True
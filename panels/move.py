@@ -14,6 +14,7 @@ class Panel(ScreenPanel):
 
     def __init__(self, screen, title):
         super().__init__(screen, title)
+        self.extra_subscriptions = {"gcode_move": ["gcode_position"]}
 
         if self.ks_printer_cfg is not None:
             dis = self.ks_printer_cfg.get("move_distances", '0.1, 0.5, 1, 5, 10, 25, 100')
@@ -207,32 +207,12 @@ class Panel(ScreenPanel):
             return pixbuf.scale_simple(new_width, new_height, GdkPixbuf.InterpType.BILINEAR)
         
         if has_thumb:
-            loc = self._files.get_thumbnail_location(filename)
-            logging.info(f"Thumbnail location: {loc}")
-            
-            if loc and loc[0] == "file":
-                # 本地文件缩略图
-                thumb_path = loc[1]
-                logging.info(f"Loading local thumbnail from: {thumb_path}")
-                # 检查文件是否存在
-                if os.path.exists(thumb_path):
-                    logging.info(f"Thumbnail file exists at: {thumb_path}")
-                    try:
-                        pixbuf = GdkPixbuf.Pixbuf.new_from_file(thumb_path)
-                        return scale_pixbuf(pixbuf, width, height)
-                    except Exception as e:
-                        logging.error(f"Error loading thumbnail: {str(e)}")
-                else:
-                    logging.error(f"Thumbnail file not found at: {thumb_path}")
-            if loc and loc[0] == "http":
-                # HTTP缩略图
-                logging.info(f"Loading HTTP thumbnail from: {loc[1]}")
-                try:
-                    pixbuf = self._gtk.PixbufFromHttp(loc[1])
-                    return scale_pixbuf(pixbuf, width, height)
-                except Exception as e:
-                    logging.error(f"Error loading HTTP thumbnail: {str(e)}")
-        
+            # 通过共享的缩略图缓存加载
+            pixbuf = super().get_file_image(filename, width, height)
+            if pixbuf is not None:
+                return pixbuf
+            logging.error(f"Error loading thumbnail of {filename}")
+
         # 如果没有找到缩略图，尝试直接查找 .thumbs 目录
         gcode_dir = os.path.dirname(self.print_state_file).replace('config', 'gcodes')
         thumbs_dir = os.path.join(gcode_dir, '.thumbs')
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import bisect
 import logging
 import os
 import gi
@@ -11,8 +12,9 @@ from ks_includes.screen_panel import ScreenPanel
 
 class Panel(ScreenPanel):
     cur_directory = "gcodes"
-    dir_panels = {}
     filelist = {'gcodes': {'directories': [], 'files': []}}
+    # Rows built above and below the viewport
+    overscan = 4
 
     def __init__(self, screen, title):
         super().__init__(screen, title)
@@ -27,10 +29,6 @@ class Panel(ScreenPanel):
         }
         self.sort_icon = ["arrow-up", "arrow-down"]
         self.scroll = self._gtk.ScrolledWindow()
-        self.files = {}
-        self.directories = {}
-        self.labels['directories'] = {}
-        self.labels['files'] = {}
         self.source = ""
         self.time_24 = self._config.get_main_config().getboolean("24htime", True)
         self.space = '  ' if self._screen.width > 480 else '\n'
@@ -66,11 +64,21 @@ class Panel(ScreenPanel):
         self.main.pack_start(pbox, False, False, 0)
         self.main.pack_start(self.scroll, True, True, 0)
 
-        self.dir_panels['gcodes'] = Gtk.Grid()
+        # Only the rows around the viewport exist, they are placed at fixed heights in the layout
+        # and bound again to other entries of the directory as it scrolls
+        self.file_keys = {}
+        self.refresh_pending = False
+        self.rows = {}
+        self.free_rows = []
+        self.row_width = 0
+        self.row_height = 0
+        self.layout = Gtk.Layout()
+        self.layout.connect("size-allocate", self.layout_allocated)
+        self.scroll.add(self.layout)
+        self.scroll.get_vadjustment().connect("value-changed", self.update_rows)
 
         GLib.idle_add(self.reload_files)
 
-        self.scroll.add(self.dir_panels['gcodes'])
         self.content.add(self.main)
         self._screen.files.add_file_callback(self._callback)
         self.showing_rename = False
@@ -80,33 +88,23 @@ class Panel(ScreenPanel):
             self.change_dir(None, "gcodes")
         self._refresh_files()
 
-    def add_directory(self, directory, show=True):
-        parent_dir = os.path.dirname(directory)
-        modified = 0
-        for x in self._files.directories:
-            if x['dirname'] == os.path.split(directory)[-1]:
-                modified = x['modified']
-                break
-        if directory not in self.filelist:
-            self.filelist[directory] = {'directories': [], 'files': [], 'modified': modified}
-            self.filelist[parent_dir]['directories'].append(directory)
-
-        if directory not in self.labels['directories']:
-            self._create_row(directory)
-        reverse = self.sort_current[1] != 0
-        dirs = sorted(
-            self.filelist[parent_dir]['directories'],
-            reverse=reverse, key=lambda item: self.filelist[item]['modified']
-        ) if self.sort_current[0] == "date" else sorted(self.filelist[parent_dir]['directories'], reverse=reverse)
-
-        pos = dirs.index(directory)
+    def sort_key(self, path, is_dir):
+        # Entries are kept in ascending order of these keys, descending order reads them backwards
+        if self.sort_current[0] == "date":
+            if is_dir:
+                return self._files.get_dir_modified(path[7:]), path
+            return self._files.get_file_info(path)['modified'], path
+        return path,
 
-        self.dir_panels[parent_dir].insert_row(pos)
-        self.dir_panels[parent_dir].attach(self.directories[directory], 0, pos, 1, 1)
-        if show is True:
-            self.dir_panels[parent_dir].show_all()
+    def add_directory(self, directory, bulk=False):
+        parent_dir = os.path.dirname(directory)
+        self.filelist[directory] = {'directories': [], 'files': [], 'key': self.sort_key(directory, True)}
+        self.insert_entry(self.filelist[parent_dir]['directories'], self.filelist[directory]['key'], bulk)
 
-    def add_file(self, filepath, show=True):
+    def add_file(self, filepath, bulk=False):
+        # With bulk the lists are left unsorted, the caller sorts them once at the end
+        if filepath in self.file_keys:
+            return False
         fileinfo = self._screen.files.get_file_info(filepath)
         if fileinfo is None:
             return
@@ -116,59 +114,161 @@ class Panel(ScreenPanel):
         directory = os.path.dirname(os.path.join("gcodes", filepath))
         d = directory.split(os.sep)
         for i in range(1, len(d)):
-            curdir = os.path.join(*d[:i])
             newdir = os.path.join(*d[:i + 1])
-            if newdir not in self.filelist[curdir]['directories']:
-                if newdir.startswith("."):
+            if newdir not in self.filelist:
+                if d[i].startswith("."):
                     return
-                self.add_directory(newdir)
-
-        if filename not in self.filelist[directory]['files']:
-            for i in range(1, len(d)):
-                curdir = os.path.join(*d[:i + 1])
-                if self.time_24:
-                    time = f":<b>{self.space}" \
-                           f"{datetime.fromtimestamp(self.filelist[curdir]['modified']):%Y/%m/%d %H:%M}</b>"
-                else:
-                    time = f":<b>{self.space}" \
-                           f"{datetime.fromtimestamp(self.filelist[curdir]['modified']):%Y/%m/%d %I:%M %p}</b>"
-                info = _("Modified") + time
-                info += "\n" + _("Size") + f':<b>{self.space}{self.format_size(fileinfo["size"])}</b>'
-                self.labels['directories'][curdir]['info'].set_markup(info)
-            self.filelist[directory]['files'].append(filename)
-
-        if filepath not in self.files:
-            self._create_row(filepath, filename)
-        reverse = self.sort_current[1] != 0
-        files = sorted(
-            self.filelist[directory]['files'],
-            reverse=reverse,
-            key=lambda item: self._screen.files.get_file_info(f"{directory}/{item}"[7:])['modified']
-        ) if self.sort_current[0] == "date" else sorted(self.filelist[directory]['files'], reverse=reverse)
-
-        pos = files.index(filename)
-        pos += len(self.filelist[directory]['directories'])
-
-        self.dir_panels[directory].insert_row(pos)
-        self.dir_panels[directory].attach(self.files[filepath], 0, pos, 1, 1)
-        if show is True:
-            self.dir_panels[directory].show_all()
+                self.add_directory(newdir, bulk)
+
+        self.file_keys[filepath] = self.sort_key(filepath, False)
+        self.insert_entry(self.filelist[directory]['files'], self.file_keys[filepath], bulk)
+        if not bulk:
+            self.update_directory_keys(directory)
+        return False
+
+    def update_directory_keys(self, directory):
+        # A newer file changes the date of the directories above it, and their position
+        while directory != "gcodes":
+            key = self.sort_key(directory, True)
+            if key == self.filelist[directory]['key']:
+                return
+            entries = self.filelist[os.path.dirname(directory)]['directories']
+            self.remove_entry(entries, self.filelist[directory]['key'])
+            self.filelist[directory]['key'] = key
+            self.insert_entry(entries, key, False)
+            directory = os.path.dirname(directory)
+
+    def insert_entry(self, entries, key, bulk):
+        if bulk:
+            entries.append(key)
+            return
+        bisect.insort(entries, key)
+        self.schedule_refresh()
+
+    @staticmethod
+    def remove_entry(entries, key):
+        index = bisect.bisect_left(entries, key)
+        if index < len(entries) and entries[index] == key:
+            del entries[index]
+
+    def schedule_refresh(self):
+        if not self.refresh_pending:
+            self.refresh_pending = True
+            GLib.idle_add(self.refresh_rows)
+
+    def refresh_rows(self):
+        self.refresh_pending = False
+        for index in list(self.rows):
+            self.recycle_row(index)
+        self.update_rows()
         return False
 
-    def _create_row(self, fullpath, filename=None):
+    def count_entries(self):
+        return len(self.filelist[self.cur_directory]['directories']) + len(self.filelist[self.cur_directory]['files'])
+
+    def get_entry(self, index):
+        # Directories first, then files, returns the path and if it's a directory
+        directory = self.filelist[self.cur_directory]
+        reverse = self.sort_current[1] != 0
+        if index < len(directory['directories']):
+            return directory['directories'][-1 - index if reverse else index][-1], True
+        index -= len(directory['directories'])
+        return directory['files'][-1 - index if reverse else index][-1], False
+
+    def layout_allocated(self, widget, allocation):
+        if allocation.width != self.row_width:
+            self.row_width = allocation.width
+            self.row_height = 0
+            self.schedule_refresh()
+
+    def measure_rows(self):
+        # Rows have a fixed height, that of a row with a name of two lines and all the info
+        if not self.free_rows:
+            self.free_rows.append(self._create_row())
+            self.layout.put(self.free_rows[-1]['row'], 0, 0)
+            self.free_rows[-1]['row'].hide()
+        row = self.free_rows[-1]
+        row['name'].set_markup("<big><b>W\nW</b></big>")
+        row['info'].set_markup("W\nW\nW")
+        self.row_height = max(row['row'].get_preferred_height_for_width(self.row_width)[1], 1)
+
+    def update_rows(self, *args):
+        if self.cur_directory not in self.filelist or self.row_width <= 1:
+            return
+        if not self.row_height:
+            self.measure_rows()
+        count = self.count_entries()
+        self.layout.set_size(self.row_width, self.row_height * count)
+        adj = self.scroll.get_vadjustment()
+        first = max(0, int(adj.get_value() // self.row_height) - self.overscan)
+        last = min(count, int((adj.get_value() + adj.get_page_size()) // self.row_height) + 1
+                   + self.overscan)
+        for index in [index for index in self.rows if not first <= index < last]:
+            self.recycle_row(index)
+        visible = []
+        for index in range(first, last):
+            if index not in self.rows:
+                row = self.free_rows.pop() if self.free_rows else self._create_row()
+                self.rows[index] = row
+                self.bind_row(row, index)
+            if not self.rows[index]['is_dir']:
+                visible.append(self.rows[index]['path'])
+        self._files.prioritize_metadata(visible)
+
+    def recycle_row(self, index):
+        row = self.rows.pop(index)
+        self._screen.thumbnails.cancel(row['row'])
+        row['row'].hide()
+        row['path'] = None
+        self.free_rows.append(row)
+
+    def bind_row(self, row, index):
+        path, is_dir = self.get_entry(index)
+        row['path'] = path
+        if is_dir:
+            row['name'].set_markup(f"<big><b>{os.path.split(path)[-1]}</b></big>")
+            row['info'].set_markup(self.get_dir_info_str(path))
+            if row['is_dir'] is not True:
+                row['icon'].set_image(self._gtk.Image("folder"))
+                row['action'].set_image(self._gtk.Image("load"))
+            row['action'].show()
+        else:
+            filename = os.path.basename(path)
+            row['name'].set_markup(f'<big><b>{os.path.splitext(filename)[0].replace("_", " ")}</b></big>')
+            row['info'].set_markup(self.get_file_info_str(path) or "")
+            if row['is_dir'] is not False:
+                row['action'].set_image(self._gtk.Image("print"))
+            row['icon'].set_image(None)
+            self.load_file_image(path, lambda pixbuf: self.image_loaded(row, path, pixbuf), small=True,
+                                 priority=self._screen.thumbnails.VISIBLE, group=row['row'])
+            row['action'].set_visible(os.path.splitext(filename)[1] in [".gcode", ".g", ".gco"])
+        row['is_dir'] = is_dir
+        row['row'].set_size_request(self.row_width, self.row_height)
+        if row['row'].get_parent() is None:
+            self.layout.put(row['row'], 0, index * self.row_height)
+        else:
+            self.layout.move(row['row'], 0, index * self.row_height)
+        row['row'].show()
+
+    def image_loaded(self, row, path, pixbuf):
+        if row['path'] != path:
+            return
+        if pixbuf is not None:
+            row['icon'].set_image(Gtk.Image.new_from_pixbuf(pixbuf))
+        else:
+            row['icon'].set_image(self._gtk.Image("file"))
+
+    def _create_row(self):
         name = Gtk.Label()
         name.get_style_context().add_class("print-filename")
-        if filename:
-            name.set_markup(f'<big><b>{os.path.splitext(filename)[0].replace("_", " ")}</b></big>')
-        else:
-            name.set_markup(f"<big><b>{os.path.split(fullpath)[-1]}</b></big>")
         name.set_hexpand(True)
         name.set_halign(Gtk.Align.START)
         name.set_line_wrap(True)
         name.set_line_wrap_mode(Pango.WrapMode.CHAR)
+        name.set_lines(2)
+        name.set_ellipsize(Pango.EllipsizeMode.END)
 
         info = Gtk.Label()
-        name.set_line_wrap(True)
         info.set_line_wrap_mode(Pango.WrapMode.CHAR)
         info.set_hexpand(True)
         info.set_halign(Gtk.Align.START)
@@ -178,28 +278,11 @@ class Panel(ScreenPanel):
         delete.set_hexpand(False)
         rename = self._gtk.Button("files", style="color2", scale=self.bts)
         rename.set_hexpand(False)
-
-        if filename:
-            action = self._gtk.Button("print", style="color3")
-            action.connect("clicked", self.confirm_print, fullpath)
-            info.set_markup(self.get_file_info_str(fullpath))
-            icon = Gtk.Button()
-            icon.connect("clicked", self.confirm_print, fullpath)
-            delete.connect("clicked", self.confirm_delete_file, f"gcodes/{fullpath}")
-            rename.connect("clicked", self.show_rename, f"gcodes/{fullpath}")
-            GLib.idle_add(self.image_load, fullpath)
-        else:
-            action = self._gtk.Button("load", style="color3")
-            action.connect("clicked", self.change_dir, fullpath)
-            icon = self._gtk.Button("folder")
-            icon.connect("clicked", self.change_dir, fullpath)
-            delete.connect("clicked", self.confirm_delete_directory, fullpath)
-            rename.connect("clicked", self.show_rename, fullpath)
-        icon.set_hexpand(False)
+        action = self._gtk.Button("print", style="color3")
         action.set_hexpand(False)
         action.set_halign(Gtk.Align.END)
-
-        delete.connect("clicked", self.confirm_delete_file, f"gcodes/{fullpath}")
+        icon = Gtk.Button()
+        icon.set_hexpand(False)
 
         row = Gtk.Grid()
         row.get_style_context().add_class("frame-item")
@@ -210,32 +293,35 @@ class Panel(ScreenPanel):
         row.attach(info, 1, 1, 1, 1)
         row.attach(rename, 2, 1, 1, 1)
         row.attach(delete, 3, 1, 1, 1)
-
-        if not filename or (filename and os.path.splitext(filename)[1] in [".gcode", ".g", ".gco"]):
-            row.attach(action, 4, 0, 1, 2)
-
-        if filename is not None:
-            self.files[fullpath] = row
-            self.labels['files'][fullpath] = {
-                "icon": icon,
-                "info": info,
-                "name": name
-            }
+        row.attach(action, 4, 0, 1, 2)
+        row.show_all()
+
+        item = {"row": row, "icon": icon, "name": name, "info": info, "action": action, "path": None, "is_dir": None}
+        action.connect("clicked", self.row_open, item)
+        icon.connect("clicked", self.row_open, item)
+        delete.connect("clicked", self.row_delete, item)
+        rename.connect("clicked", self.row_rename, item)
+        return item
+
+    def row_open(self, widget, row):
+        if row['path'] is None:
+            return
+        if row['is_dir']:
+            self.change_dir(widget, row['path'])
         else:
-            self.directories[fullpath] = row
-            self.labels['directories'][fullpath] = {
-                "info": info,
-                "name": name
-            }
-            self.dir_panels[fullpath] = Gtk.Grid()
-
-    def image_load(self, filepath):
-        pixbuf = self.get_file_image(filepath, small=True)
-        if pixbuf is not None:
-            self.labels['files'][filepath]['icon'].set_image(Gtk.Image.new_from_pixbuf(pixbuf))
+            self.confirm_print(widget, row['path'])
+
+    def row_delete(self, widget, row):
+        if row['path'] is None:
+            return
+        if row['is_dir']:
+            self.confirm_delete_directory(widget, row['path'])
         else:
-            self.labels['files'][filepath]['icon'].set_image(self._gtk.Image("file"))
-        return False
+            self.confirm_delete_file(widget, f"gcodes/{row['path']}")
+
+    def row_rename(self, widget, row):
+        if row['path'] is not None:
+            self.show_rename(widget, row['path'] if row['is_dir'] else f"gcodes/{row['path']}")
 
     def confirm_delete_file(self, widget, filepath):
         logging.debug(f"Sending delete_file {filepath}")
@@ -267,17 +353,13 @@ class Panel(ScreenPanel):
         return False
 
     def change_dir(self, widget, directory):
-        if directory not in self.dir_panels:
+        if directory not in self.filelist:
             return
         logging.debug(f"Changing dir to {directory}")
-
-        for child in self.scroll.get_children():
-            self.scroll.remove(child)
         self.cur_directory = directory
         self.labels['path'].set_text(f"  {self.cur_directory[7:]}")
-
-        self.scroll.add(self.dir_panels[directory])
-        self.content.show_all()
+        self.scroll.get_vadjustment().set_value(0)
+        self.schedule_refresh()
 
     def change_sort(self, widget, key):
         if self.sort_current[0] == key:
@@ -357,37 +439,23 @@ class Panel(ScreenPanel):
             self._screen.state_printing()
     def delete_file(self, filename):
         directory = os.path.join("gcodes", os.path.dirname(filename)) if os.path.dirname(filename) else "gcodes"
-        if directory not in self.filelist or os.path.basename(filename).startswith("."):
+        if directory not in self.filelist or filename not in self.file_keys:
             return
-        try:
-            self.filelist[directory]["files"].pop(self.filelist[directory]["files"].index(os.path.basename(filename)))
-        except Exception as e:
-            logging.exception(e)
-        dir_parts = directory.split(os.sep)
-        i = len(dir_parts)
-        while i > 1:
-            cur_dir = os.path.join(*dir_parts[:i])
-            if len(self.filelist[cur_dir]['directories']) > 0 or len(self.filelist[cur_dir]['files']) > 0:
-                break
-            parent_dir = os.path.dirname(cur_dir)
-
-            if self.cur_directory == cur_dir:
+        self.remove_entry(self.filelist[directory]['files'], self.file_keys.pop(filename))
+        while directory != "gcodes" and not self.filelist[directory]['directories'] \
+                and not self.filelist[directory]['files']:
+            parent_dir = os.path.dirname(directory)
+            if self.cur_directory == directory:
                 self.change_dir(None, parent_dir)
+            self.remove_entry(self.filelist[parent_dir]['directories'], self.filelist.pop(directory)['key'])
+            directory = parent_dir
+        self.schedule_refresh()
 
-            del self.filelist[cur_dir]
-            self.filelist[parent_dir]['directories'].pop(self.filelist[parent_dir]['directories'].index(cur_dir))
-            self.dir_panels[parent_dir].remove(self.directories[cur_dir])
-            del self.directories[cur_dir]
-            del self.labels['directories'][cur_dir]
-            self.dir_panels[parent_dir].show_all()
-            i -= 1
-
-        try:
-            self.dir_panels[directory].remove(self.files[filename])
-        except Exception as e:
-            logging.exception(e)
-        self.dir_panels[directory].show_all()
-        self.files.pop(filename)
+    def get_dir_info_str(self, directory):
+        modified = self._files.get_dir_modified(directory[7:])
+        if self.time_24:
+            return _("Modified") + f":<b>{self.space}{datetime.fromtimestamp(modified):%Y/%m/%d %H:%M}</b>"
+        return _("Modified") + f":<b>{self.space}{datetime.fromtimestamp(modified):%Y/%m/%d %I:%M %p}</b>"
 
     def get_file_info_str(self, filename):
 
@@ -408,26 +476,40 @@ class Panel(ScreenPanel):
 
     def reload_files(self, widget=None):
         self.filelist = {'gcodes': {'directories': [], 'files': []}}
-        for dirpan in self.dir_panels:
-            for child in self.dir_panels[dirpan].get_children():
-                self.dir_panels[dirpan].remove(child)
-
-        flist = sorted(self._screen.files.get_file_list(), key=lambda item: '/' in item)
-        for file in flist:
-            GLib.idle_add(self.add_file, file)
+        self.file_keys = {}
+        for file in self._screen.files.get_file_list():
+            self.add_file(file, bulk=True)
+        for directory in self.filelist.values():
+            directory['directories'].sort()
+            directory['files'].sort()
+        if self.cur_directory not in self.filelist:
+            self.change_dir(None, "gcodes")
+        self.schedule_refresh()
         return False
 
     def update_file(self, filename):
-        if filename not in self.labels['files']:
-            logging.debug(f"Cannot update file, file not in labels: {filename}")
+        if filename not in self.file_keys:
             return
-
-        self.labels['files'][filename]['info'].set_markup(self.get_file_info_str(filename))
-
-        # Update icon
-        GLib.idle_add(self.image_load, filename)
+        key = self.sort_key(filename, False)
+        if key != self.file_keys[filename]:
+            # The modification time changed the position of the file
+            directory = os.path.dirname(os.path.join("gcodes", filename))
+            files = self.filelist[directory]['files']
+            self.remove_entry(files, self.file_keys[filename])
+            self.file_keys[filename] = key
+            self.insert_entry(files, key, False)
+            self.update_directory_keys(directory)
+            return
+        for index, row in self.rows.items():
+            if row['path'] == filename and not row['is_dir']:
+                self._screen.thumbnails.cancel(row['row'])
+                self.bind_row(row, index)
 
     def _callback(self, newfiles, deletedfiles, updatedfiles=None):
+        if len(newfiles) > 100:
+            # Sorting everything once is cheaper than inserting one by one
+            self.reload_files()
+            newfiles = []
         for file in newfiles:
             self.add_file(file)
         for file in deletedfiles:
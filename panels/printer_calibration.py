@@ -610,7 +610,7 @@ class Panel(ScreenPanel):
 
     def get_file_list(self):
         folder_path = None
-        if "virtual_sdcard" in self._screen.printer.get_config_section_list():
+        if self._screen.printer.config_section_exists("virtual_sdcard"):
             vsd = self._screen.printer.get_config_section("virtual_sdcard")
             if "path" in vsd:
                 folder_path = os.path.expanduser(vsd['path'])  
@@ -26,14 +26,20 @@ class Panel(ScreenPanel):
         self.grid = self._gtk.HomogeneousGrid()
         self._gtk.reset_temp_color()
         self.grid.attach(self.create_left_panel(), 0, 0, 1, 1)
+        # The panel can be built in idle time, what depends on the state is set up on the first show
+        self.extra = extra
+        self.state_pending = True
+        self.content.add(self.grid)
 
+    def setup_state(self):
+        self.state_pending = False
         # When printing start in temp_delta mode and only select tools
         selection = []
         if self._printer.state not in ["printing", "paused"]:
             self.show_preheat = True
             selection.extend(self._printer.get_temp_devices())
-        elif extra:
-            selection.append(extra)
+        elif self.extra:
+            selection.append(self.extra)
 
         # Select heaters
         for h in selection:
@@ -51,8 +57,6 @@ class Panel(ScreenPanel):
         else:
             self.grid.attach(self.create_right_panel(), 1, 0, 1, 1)
 
-        self.content.add(self.grid)
-
     def create_right_panel(self):
         cooldown = self._gtk.Button('cool-down', _('Cooldown'), "color4", self.bts, Gtk.PositionType.LEFT, 1)
         adjust = self._gtk.Button('fine-tune', None, "color3", self.bts * 1.4, Gtk.PositionType.LEFT, 1)
@@ -191,6 +195,8 @@ class Panel(ScreenPanel):
                 self.graph_update = None
 
     def activate(self):
+        if self.state_pending:
+            self.setup_state()
         self.update_graph_visibility()
 
     def deactivate(self):
@@ -13,6 +13,7 @@ class Panel(ScreenPanel):
 
     def __init__(self, screen, title):
         super().__init__(screen, title)
+        self.extra_subscriptions = {"gcode_move": ["gcode_position"]}
         self.z_offset = None
         self.probe = self._printer.get_probe()
         if self.probe:
@@ -177,7 +178,7 @@ class Panel(ScreenPanel):
                 speed = self.probe['speed']
 
         # Use safe_z_home position
-        if "safe_z_home" in self._printer.get_config_section_list():
+        if self._printer.config_section_exists("safe_z_home"):
             safe_z = self._printer.get_config_section("safe_z_home")
             safe_z_xy = safe_z['home_xy_position']
             safe_z_xy = [str(i.strip()) for i in safe_z_xy.split(',')]
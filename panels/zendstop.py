@@ -13,6 +13,7 @@ class Panel(ScreenPanel):
 
     def __init__(self, screen, title):
         super().__init__(screen, title)
+        self.extra_subscriptions = {"gcode_move": ["gcode_position"]}
         self.z_offset = None
         self.probe = self._printer.get_probe()
         if self.probe:
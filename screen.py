@@ -1,6 +1,7 @@
 #!/usr/bin/python
 
 import argparse
+import copy
 import json
 import logging
 import os
@@ -12,12 +13,15 @@ import sys
 import gi
 import configparser
 import threading
+import time
 
 gi.require_version("Gtk", "3.0")
 from gi.repository import Gtk, Gdk, GLib, Pango
 from importlib import import_module
 from jinja2 import Environment
 from signal import SIGTERM
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from ks_includes import functions
@@ -25,7 +29,10 @@ from ks_includes.KlippyWebsocket import KlippyWebsocket
 from ks_includes.KlippyRest import KlippyRest
 from ks_includes.files import KlippyFiles
 from ks_includes.KlippyGtk import KlippyGtk
-from ks_includes.printer import Printer
+from ks_includes.metrics import metrics
+from ks_includes.printer import Printer, SnapshotStore
+from ks_includes.recorder import WebsocketRecorder
+from ks_includes.thumbnails import ThumbnailLoader
 from ks_includes.widgets.keyboard import Keyboard
 from ks_includes.config import KlipperScreenConfig
 from panels.base_panel import BasePanel
@@ -52,6 +59,25 @@ PRINTER_BASE_STATUS_OBJECTS = [
     'manual_probe',
 ]
 
+# Fields that change continuously while printing, only subscribed when a panel consumes them
+HIGH_RATE_FIELDS = {
+    'motion_report': None,
+    'toolhead': ["position", "estimated_print_time", "print_time"],
+    'gcode_move': ["gcode_position"],
+    'virtual_sdcard': ["file_position"],
+}
+
+# Objects kept while the screensaver is shown, besides the temperature devices and filament sensors
+SCREENSAVER_STATUS_OBJECTS = [
+    'webhooks',
+    'print_stats',
+    'idle_timeout',
+    'pause_resume',
+    'manual_probe',
+    'toolhead',
+    'virtual_sdcard',
+]
+
 klipperscreendir = pathlib.Path(__file__).parent.resolve()
 
 
@@ -89,16 +115,22 @@ class KlipperScreen(Gtk.Window):
     printers = printer = None
     updating = False
     _ws = None
+    subscribed_objects = None
     screensaver_timeout = None
     reinit_count = 0
     max_retries = 4
     initialized = initializing = False
+    warm = False
+    warmup = None
+    recorder = None
+    warmed_up = False
     popup_timeout = None
     wayland = False
     windowed = False
     notification_log = []
     auto_check = True
     def __init__(self, args):
+        self.tracer = functions.StartupTracer()
         try:
             super().__init__(title="KlipperScreen")
         except Exception as e:
@@ -111,6 +143,9 @@ class KlipperScreen(Gtk.Window):
         self.confirm = None
         self.panels_reinit = []
         self.manual_settings = {}
+        self.preloaded = set()
+        data_dir = functions.get_data_dir()
+        self.snapshots = SnapshotStore(os.path.join(data_dir, "printers.json") if data_dir else None)
 
         configfile = os.path.normpath(os.path.expanduser(args.configfile))
 
@@ -118,6 +153,12 @@ class KlipperScreen(Gtk.Window):
         self.lang_ltr = set_text_direction(self._config.get_main_config().get("language", None))
         self.env = Environment(extensions=["jinja2.ext.i18n"], autoescape=True)
         self.env.install_gettext_translations(self._config.get_lang())
+        self.tracer.mark("config")
+        record = self._config.get_main_config().get("websocket_record", None)
+        if record:
+            self.recorder = WebsocketRecorder(os.path.expanduser(record))
+        if self._config.get_main_config().getboolean("metrics", False):
+            metrics.start(self._config.get_main_config().getint("metrics_log_interval", 60))
 
         self.connect("key-press-event", self._key_press_event)
         # self.connect("configure_event", self.update_size)
@@ -151,12 +192,15 @@ class KlipperScreen(Gtk.Window):
            
         self.show_cursor = self._config.get_main_config().getboolean("show_cursor", fallback=False)
         self.gtk = KlippyGtk(self)
+        self.thumbnails = ThumbnailLoader(self)
         self.init_style()
+        self.tracer.mark("init_style")
         self.set_icon_from_file(os.path.join(klipperscreendir, "styles", "icon.svg"))
 
         self.base_panel = BasePanel(self, title="Base Panel")
         self.add(self.base_panel.main_grid)
         self.show_all()
+        self.tracer.mark("BasePanel")
         if self.show_cursor:
             self.get_window().set_cursor(
                 Gdk.Cursor.new_for_display(Gdk.Display.get_default(), Gdk.CursorType.ARROW))
@@ -173,6 +217,7 @@ class KlipperScreen(Gtk.Window):
         self.set_screenblanking_timeout(self._config.get_main_config().get('screen_blanking'))
         self.log_notification("KlipperScreen Started", 1)
         self.initial_connection()
+        self.tracer.mark("initial_connection")
 
         self.setup_init = 0
         self.klippy_config_path = None
@@ -225,6 +270,10 @@ class KlipperScreen(Gtk.Window):
             self.show_printer_select()
 
     def connect_printer(self, name):
+        # A reconnection before the printer was ready keeps the interface built from the snapshot
+        warm = self.warm and name == self.connecting_to_printer
+        if not warm:
+            self.end_warm_start()
         self.connecting_to_printer = name
         if self._ws is not None and self._ws.connected:
             self._ws.close()
@@ -236,6 +285,7 @@ class KlipperScreen(Gtk.Window):
 
         self.connecting = True
         self.initialized = False
+        self.subscribed_objects = None
 
         ind = 0
         logging.info(f"Connecting to printer: {name}")
@@ -245,14 +295,14 @@ class KlipperScreen(Gtk.Window):
                 break
 
         self.printer = self.printers[ind]["data"]
+        if self.apiclient is not None:
+            self.apiclient.close()
         self.apiclient = KlippyRest(
             self.printers[ind][name]["moonraker_host"],
             self.printers[ind][name]["moonraker_port"],
             self.printers[ind][name]["moonraker_api_key"],
         )
 
-        self.printer_initializing(_("Connecting to %s") % name, remove=True)
-
         self._ws = KlippyWebsocket(self,
                                    {
                                        "on_connect": self.init_printer,
@@ -264,45 +314,125 @@ class KlipperScreen(Gtk.Window):
                                    )
 
         self.files = KlippyFiles(self)
+        self.warm = warm or self.warm_start(name)
+        self.printer_initializing(_("Connecting to %s") % name, remove=True)
         self._ws.initial_connect()
 
-    def ws_subscribe(self):
+    def warm_start(self, name):
+        # Shows the menu built from the last known configuration of the printer while it becomes ready
+        if self.printer.config or not self._config.get_main_config().getboolean("warm_start", True):
+            return False
+        snapshot = self.snapshots.get(name)
+        if snapshot is None:
+            return False
+        try:
+            self.printer.load_snapshot(snapshot)
+        except Exception as e:
+            logging.error(f"Unable to load the snapshot of {name}: {e}")
+            self.printer.config = {}
+            return False
+        logging.info(f"Warm start from the snapshot of {name}")
+        self.base_panel.set_ks_printer_cfg(name)
+        self.show_panel("main_menu", None, remove_all=True, items=self._config.get_menu_items("__main"))
+        return True
+
+    def end_warm_start(self):
+        if self.warm:
+            self.warm = False
+            self.base_panel.set_stale(None)
+
+    def get_status_subscriptions(self):
         requested_updates = {
-            "objects": {
-                "bed_mesh": ["profile_name", "mesh_max", "mesh_min", "probed_matrix", "profiles"],
-                "configfile": ["config"],
-                "display_status": ["progress", "message"],
-                "fan": ["speed"],
-                "gcode_move": ["extrude_factor", "gcode_position", "homing_origin", "speed_factor", "speed"],
-                "idle_timeout": ["state"],
-                "pause_resume": ["is_paused"],
-                "print_stats": ["print_duration", "total_duration", "filament_used", "filename", "state", "message",
-                                "info"],
-                "toolhead": ["homed_axes", "estimated_print_time", "print_time", "position", "extruder",
-                             "max_accel", "max_accel_to_decel", "max_velocity", "square_corner_velocity"],
-                "virtual_sdcard": ["file_position", "is_active", "progress"],
-                "webhooks": ["state", "state_message"],
-                "firmware_retraction": ["retract_length", "retract_speed", "unretract_extra_length", "unretract_speed"],
-                "motion_report": ["live_position", "live_velocity", "live_extruder_velocity"],
-                "exclude_object": ["current_object", "objects", "excluded_objects"],
-                "manual_probe": ['is_active'],
-            }
+            "bed_mesh": ["profile_name", "mesh_max", "mesh_min", "probed_matrix", "profiles"],
+            "display_status": ["progress", "message"],
+            "fan": ["speed"],
+            "gcode_move": ["extrude_factor", "gcode_position", "homing_origin", "speed_factor", "speed"],
+            "idle_timeout": ["state"],
+            "pause_resume": ["is_paused"],
+            "print_stats": ["print_duration", "total_duration", "filament_used", "filename", "state", "message",
+                            "info"],
+            "toolhead": ["homed_axes", "estimated_print_time", "print_time", "position", "extruder",
+                         "max_accel", "max_accel_to_decel", "max_velocity", "square_corner_velocity"],
+            "virtual_sdcard": ["file_position", "is_active", "progress"],
+            "webhooks": ["state", "state_message"],
+            "firmware_retraction": ["retract_length", "retract_speed", "unretract_extra_length", "unretract_speed"],
+            "motion_report": ["live_position", "live_velocity", "live_extruder_velocity"],
+            "exclude_object": ["current_object", "objects", "excluded_objects"],
+            "manual_probe": ['is_active'],
         }
         for extruder in self.printer.get_tools():
-            requested_updates['objects'][extruder] = [
+            requested_updates[extruder] = [
                 "target", "temperature", "pressure_advance", "smooth_time", "power"]
         for h in self.printer.get_heaters():
-            requested_updates['objects'][h] = ["target", "temperature", "power"]
+            requested_updates[h] = ["target", "temperature", "power"]
         for f in self.printer.get_fans():
-            requested_updates['objects'][f] = ["speed"]
+            requested_updates[f] = ["speed"]
         for f in self.printer.get_filament_sensors():
-            requested_updates['objects'][f] = ["enabled", "filament_detected"]
+            requested_updates[f] = ["enabled", "filament_detected"]
         for p in self.printer.get_output_pins():
-            requested_updates['objects'][p] = ["value"]
+            requested_updates[p] = ["value"]
         for led in self.printer.get_leds():
-            requested_updates['objects'][led] = ["color_data"]
+            requested_updates[led] = ["color_data"]
+        return requested_updates
 
-        self._ws.klippy.object_subscription(requested_updates)
+    def get_subscription_profile(self):
+        full = self.get_status_subscriptions()
+        if self.screensaver is not None:
+            objects = SCREENSAVER_STATUS_OBJECTS + self.printer.get_temp_devices() + self.printer.get_filament_sensors()
+            return self.remove_fields({obj: full[obj] for obj in objects if obj in full}, HIGH_RATE_FIELDS)
+        panel = self.panels[self._cur_panels[-1]] if self._cur_panels else None
+        if panel is None:
+            return full
+        core = self.remove_fields(full, HIGH_RATE_FIELDS)
+        for led in self.printer.get_leds():
+            core.pop(led, None)
+        return self.merge_subscriptions(core, self.base_panel.subscriptions or {},
+                                        getattr(panel, "subscriptions", None) or {},
+                                        getattr(panel, "extra_subscriptions", None) or {})
+
+    @staticmethod
+    def remove_fields(subscriptions, remove):
+        result = {}
+        for obj, fields in subscriptions.items():
+            if obj in remove and remove[obj] is None:
+                continue
+            if obj in remove and fields is not None:
+                fields = [field for field in fields if field not in remove[obj]]
+            result[obj] = fields
+        return result
+
+    @staticmethod
+    def merge_subscriptions(*subscriptions):
+        merged = {}
+        for subs in subscriptions:
+            for obj, fields in subs.items():
+                if fields is None or (obj in merged and merged[obj] is None):
+                    merged[obj] = None
+                else:
+                    merged[obj] = sorted(set(merged.get(obj, [])) | set(fields))
+        return merged
+
+    def ws_subscribe(self):
+        self.subscribed_objects = None
+        self.update_subscriptions(force=True)
+
+    def update_subscriptions(self, force=False):
+        if self._ws is None or self.printer is None or (self.subscribed_objects is None and not force):
+            return
+        objects = self.get_subscription_profile()
+        if objects == self.subscribed_objects:
+            return
+        logging.debug(f"Subscribing to {len(objects)} objects")
+        self.subscribed_objects = objects
+        if force:
+            # Moonraker answers with the current value of every field, the whole configuration only the first time
+            objects = {**objects, "configfile": ["config"]}
+        self._ws.klippy.object_subscription({"objects": objects}, self._subscription_response)
+
+    def _subscription_response(self, result, method, params):
+        # The response holds the current status of the new subscription, refresh anything that was not subscribed
+        if "result" in result and "status" in result["result"]:
+            self._websocket_callback("notify_status_update", result["result"]["status"])
 
     @staticmethod
     def _load_panel(panel):
@@ -319,9 +449,16 @@ class KlipperScreen(Gtk.Window):
         try:
             if remove_all:
                 self._remove_all_panels()
-                self.panels_reinit = list(self.panels)
+                self.panels_reinit = [name for name in self.panels if name not in self.preloaded]
             else:
                 self._remove_current_panel()
+            if panel_name in self.preloaded:
+                # Built in idle time without arguments, the panels set up what depends on the state when activated
+                self.preloaded.discard(panel_name)
+                if kwargs:
+                    del self.panels[panel_name]
+                else:
+                    self.panels[panel_name].title = title
             if panel_name not in self.panels:
                 try:
                     self.panels[panel_name] = self._load_panel(panel).Panel(self, title, **kwargs)
@@ -337,6 +474,51 @@ class KlipperScreen(Gtk.Window):
         except Exception as e:
             logging.exception(f"Error attaching panel:\n{e}\n\n{traceback.format_exc()}")
 
+    def start_warmup(self):
+        # Imports the panels of the menus and builds the most used ones in idle time
+        if self.warmed_up:
+            return
+        self.warmed_up = True
+        budget = self._config.get_main_config().getint("preload_memory", 32) * 1024 * 1024
+        usage = functions.get_memory_usage()
+        if budget <= 0 or usage is None:
+            return
+        self.warmup_limit = usage + budget
+        build = self._config.get_main_config().get("preload_panels", "job_status, temperature")
+        build = [panel.strip() for panel in build.split(",") if panel.strip()]
+        self.warmup = deque([("build", panel) for panel in build]
+                            + [("import", panel) for panel in self._config.get_menu_panels() if panel not in build])
+        GLib.idle_add(self.warmup_step, priority=GLib.PRIORITY_LOW)
+
+    def warmup_step(self):
+        if not self.warmup:
+            self.warmup = None
+            return False
+        usage = functions.get_memory_usage()
+        if usage is None or usage > self.warmup_limit:
+            logging.info(f"Stopped preloading panels, {len(self.warmup)} left over the memory budget")
+            self.warmup = None
+            return False
+        action, panel = self.warmup.popleft()
+        try:
+            if action == "import":
+                self._load_panel(panel)
+            elif panel not in self.panels:
+                self.panels[panel] = self._load_panel(panel).Panel(self, None)
+                self.preloaded.add(panel)
+                logging.debug(f"Preloaded panel: {panel}")
+        except Exception as e:
+            logging.error(f"Unable to preload panel {panel}: {e}")
+        return True
+
+    def drop_preloaded(self):
+        # The panels were built for the previous configuration
+        self.warmup = None
+        self.warmed_up = False
+        for panel in self.preloaded:
+            del self.panels[panel]
+        self.preloaded.clear()
+
     def attach_panel(self, panel):
         self.base_panel.add_content(self.panels[panel])
         logging.debug(f"Current panel hierarchy: {' > '.join(self._cur_panels)}")
@@ -345,6 +527,7 @@ class KlipperScreen(Gtk.Window):
             self.process_update("notify_busy", self.printer.busy)
         if hasattr(self.panels[panel], "activate"):
             self.panels[panel].activate()
+        self.update_subscriptions()
         self.show_all()
 
     def log_notification(self, message, level=0):
@@ -588,6 +771,7 @@ class KlipperScreen(Gtk.Window):
         close.grab_focus()
         self.screensaver = box
         self.screensaver.show_all()
+        self.update_subscriptions()
         self.power_devices(None, self._config.get_main_config().get("screen_off_devices", ""), on=False)
         if self.screensaver_timeout is not None:
             GLib.source_remove(self.screensaver_timeout)
@@ -600,6 +784,7 @@ class KlipperScreen(Gtk.Window):
         logging.debug("Closing Screensaver")
         self.remove(self.screensaver)
         self.screensaver = None
+        self.update_subscriptions()
         self.add(self.base_panel.main_grid)
         if self.use_dpms:
             self.wake_screen()
@@ -699,6 +884,7 @@ class KlipperScreen(Gtk.Window):
         self._init_printer(_("Firmware has disconnected"), remove=True)
 
     def state_error(self):
+        self.end_warm_start()
         self.close_screensaver()
         msg = _("Firmware has encountered an error.") + "\n"
         state = self.printer.get_stat("webhooks", "state_message")
@@ -714,6 +900,7 @@ class KlipperScreen(Gtk.Window):
             self.show_panel("extrude", _("Extrude"))
 
     def state_printing(self):            
+        self.end_warm_start()
         self.close_screensaver()
         for dialog in self.dialogs:
             self.gtk.remove_dialog(dialog)
@@ -727,6 +914,8 @@ class KlipperScreen(Gtk.Window):
             logging.debug("Printer not initialized yet")
             self.printer.state = "not ready"
             return
+        self.end_warm_start()
+        self.start_warmup()
         self.show_panel("main_menu", None, remove_all=True, items=self._config.get_menu_items("__main"))
 
         #bed mesh
@@ -763,6 +952,7 @@ class KlipperScreen(Gtk.Window):
         self.printer_initializing(_("Firmware is attempting to start"))
 
     def state_shutdown(self):
+        self.end_warm_start()
         self.close_screensaver()
         msg = self.printer.get_stat("webhooks", "state_message")
         msg = msg if "ready" not in msg else ""
@@ -837,7 +1027,10 @@ class KlipperScreen(Gtk.Window):
             self.show_printer_select()
             return
         self._remove_all_panels()
-        if self.printer is not None:
+        self.drop_preloaded()
+        if self.warm:
+            self.show_panel("main_menu", None, remove_all=True, items=self._config.get_menu_items("__main"))
+        elif self.printer is not None:
             self.printer.change_state(self.printer.state)
 
     def set_filament_box_power(self, is_on):
@@ -861,7 +1054,18 @@ class KlipperScreen(Gtk.Window):
                 return
             self.printer.process_update({'webhooks': {'state': "ready"}})
         elif action == "notify_status_update" and self.printer.state != "shutdown":
-            self.printer.process_update(data)
+            changed = self.printer.process_update(data)
+            if not changed and "configfile" not in data:
+                # Repeated values, the panels already show them
+                return
+            # Only the fields that changed reach the panels
+            data = {
+                obj: fields if obj == "configfile" else {
+                    field: value for field, value in fields.items() if (obj, field) in changed
+                }
+                for obj, fields in data.items()
+                if obj == "configfile" or any((obj, field) in changed for field in fields)
+            }
             if 'manual_probe' in data and data['manual_probe']['is_active'] and 'zcalibrate' not in self._cur_panels:
                 if self.setup_init == 0:
                     self.show_panel("zcalibrate", _('Z Calibrate'))
@@ -869,7 +1073,7 @@ class KlipperScreen(Gtk.Window):
             if self.files is not None:
                 self.files.process_update(data)
         elif action == "notify_metadata_update":
-            self.files.request_metadata(data['filename'])
+            self.files.request_metadata(data['filename'], force=True)
         elif action == "notify_update_response":
             if 'message' in data and 'Error' in data['message']:
                 logging.error(f"{action}:{data['message']}")
@@ -879,7 +1083,8 @@ class KlipperScreen(Gtk.Window):
         elif action == "notify_power_changed":
             logging.debug("Power status changed: %s", data)
             self.printer.process_power_update(data)
-            self.panels['splash_screen'].check_power_status()
+            if 'splash_screen' in self.panels:
+                self.panels['splash_screen'].check_power_status()
         elif action == "notify_gcode_response" and self.printer.state not in ["error", "shutdown"]:
             if not (data.startswith("B:") or data.startswith("T:")):
                 if "RESPOND TYPE=" in data:
@@ -907,9 +1112,30 @@ class KlipperScreen(Gtk.Window):
         self.process_update(action, data)
 
     def process_update(self, *args):
-        self.base_panel.process_update(*args)
+        self.route_update(self.base_panel, *args)
         if self._cur_panels and hasattr(self.panels[self._cur_panels[-1]], "process_update"):
-            self.panels[self._cur_panels[-1]].process_update(*args)
+            self.route_update(self.panels[self._cur_panels[-1]], *args)
+
+    @staticmethod
+    def route_update(panel, action, data):
+        # Panels that declare their subscriptions only get called with the fields they consume
+        subscriptions = getattr(panel, "subscriptions", None)
+        if action == "notify_status_update" and subscriptions is not None:
+            data = {
+                obj: fields if subscriptions[obj] is None
+                else {field: fields[field] for field in subscriptions[obj] if field in fields}
+                for obj, fields in data.items()
+                if obj in subscriptions and isinstance(fields, dict)
+            }
+            data = {obj: fields for obj, fields in data.items() if fields}
+            if not data:
+                return
+        if not metrics.enabled:
+            panel.process_update(action, data)
+            return
+        start = time.perf_counter()
+        panel.process_update(action, data)
+        metrics.record(f"{type(panel).__module__}.process_update", time.perf_counter() - start)
 
     def _confirm_send_action(self, widget, text, method, params=None, save_button=True):
         buttons = [
@@ -958,7 +1184,7 @@ class KlipperScreen(Gtk.Window):
         logging.info(f"{method}: {params}")
         if isinstance(widget, Gtk.Button):
             self.gtk.Button_busy(widget, True)
-            self._ws.send_method(method, params, self.enable_widget, widget)
+            self._ws.send_method(method, params, self.enable_widget, widget, on_error=self.enable_widget)
         else:
             self._ws.send_method(method, params)
 
@@ -968,6 +1194,10 @@ class KlipperScreen(Gtk.Window):
                 GLib.timeout_add(150, self.gtk.Button_busy, x, False)
 
     def printer_initializing(self, msg, remove=False):
+        if self.warm:
+            self.base_panel.set_stale(msg)
+            self.log_notification(msg, 0)
+            return
         if 'splash_screen' not in self.panels or remove:
             self.show_panel("splash_screen", None, remove_all=True)
         self.panels['splash_screen'].update_text(msg)
@@ -1001,15 +1231,65 @@ class KlipperScreen(Gtk.Window):
     def init_printer(self):
         if self.initializing:
             return False
+        self.tracer.mark("connection")
         self.initializing = True
         if self.reinit_count > self.max_retries or 'printer_select' in self._cur_panels:
             self.initializing = False
             return False
-        state = self.apiclient.get_server_info()
+        threading.Thread(target=self._fetch_printer, args=(self.apiclient,), daemon=True).start()
+        return False
+
+    def _fetch_printer(self, apiclient):
+        # Runs in a thread, each request is issued as soon as the ones it depends on are done
+        # the results are applied together in the main thread by _commit_printer
+        try:
+            state, results = self._fetch_printer_data(apiclient)
+        except Exception as e:
+            # A malformed response must not leave the screen initializing forever
+            logging.exception(f"Unable to fetch the printer: {e}")
+            state, results = {"error": f"{e}"}, None
+        GLib.idle_add(self._commit_printer, apiclient, state, results)
+
+    @staticmethod
+    def _fetch_printer_data(apiclient):
+        state = apiclient.get_server_info()
+        if state is False:
+            return state, {}
+        components = state['result']['components']
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = {}
+            if "power" in components:
+                futures['power'] = pool.submit(apiclient.send_request, "machine/device_power/devices")
+            if "webcam" in components:
+                futures['cameras'] = pool.submit(apiclient.send_request, "server/webcams/list")
+            if state['result']['klippy_connected']:
+                futures['config'] = pool.submit(apiclient.send_request, "printer/objects/query?configfile")
+                futures['printer_info'] = pool.submit(apiclient.get_printer_info)
+                futures['gcode_help'] = pool.submit(apiclient.get_gcode_help)
+                futures['system_info'] = pool.submit(apiclient.send_request, "machine/system_info")
+                futures['server_config'] = pool.submit(apiclient.send_request, "server/config")
+                futures['tempstore'] = pool.submit(apiclient.send_request, "server/temperature_store")
+                config = futures['config'].result()
+                if config is not False:
+                    extra_items = Printer.get_config_objects(config['result']['status']['configfile']['config'])
+                    futures['data'] = pool.submit(apiclient.send_request, "printer/objects/query?"
+                                                  + "&".join(PRINTER_BASE_STATUS_OBJECTS + extra_items))
+            results = {name: future.result() for name, future in futures.items()}
+        return state, results
+
+    def _commit_printer(self, apiclient, state, results):
+        if apiclient is not self.apiclient:
+            logging.info("Discarding the initialization of a previous printer")
+            self.initializing = False
+            return self.init_printer()
         if state is False:
             logging.info("Moonraker not connected")
             self.initializing = False
             return False
+        if results is None:
+            # The fetch failed, try again later
+            self.reinit_count += 1
+            return self._init_printer(f"Error initializing the printer\n\n{state['error']}")
         self.connecting = not self._ws.connected
         self.connected_printer = self.connecting_to_printer
         self.base_panel.set_ks_printer_cfg(self.connected_printer)
@@ -1017,7 +1297,7 @@ class KlipperScreen(Gtk.Window):
         # Moonraker is ready, set a loop to init the printer
         self.reinit_count += 1
 
-        server_info = self.apiclient.get_server_info()["result"]
+        server_info = state["result"]
         logging.info(f"Moonraker info {server_info}")
         popup = ''
         level = 2
@@ -1037,14 +1317,10 @@ class KlipperScreen(Gtk.Window):
                 level = 3
         if popup:
             self.show_popup_message(popup, level)
-        if "power" in server_info["components"]:
-            powerdevs = self.apiclient.send_request("machine/device_power/devices")
-            if powerdevs is not False:
-                self.printer.configure_power_devices(powerdevs['result'])
-        if "webcam" in server_info["components"]:
-            cameras = self.apiclient.send_request("server/webcams/list")
-            if cameras is not False:
-                self.printer.configure_cameras(cameras['result']['webcams'])
+        if results.get('power'):
+            self.printer.configure_power_devices(results['power']['result'])
+        if results.get('cameras'):
+            self.printer.configure_cameras(results['cameras']['result']['webcams'])
         if "spoolman" in server_info["components"]:
             self.printer.enable_spoolman()
 
@@ -1055,40 +1331,49 @@ class KlipperScreen(Gtk.Window):
             if self.reinit_count <= self.max_retries:
                 msg += _("Retrying") + f' #{self.reinit_count}'
             return self._init_printer(msg)
-        printer_info = self.apiclient.get_printer_info()
+        printer_info = results['printer_info']
         if printer_info is False:
             return self._init_printer("Unable to get printer info from moonraker")
-        config = self.apiclient.send_request("printer/objects/query?configfile")
+        config = results['config']
         if config is False:
             return self._init_printer("Error getting printer configuration")
+        data = results['data']
+        if data is False:
+            return self._init_printer("Error getting printer object data with extra items")
         logging.debug(config['result']['status'])
+        snapshot = {
+            "printer_info": printer_info['result'],
+            "configfile": {"config": copy.deepcopy(config['result']['status']['configfile']['config'])},
+        }
         # Reinitialize printer, in case the printer was shut down and anything has changed.
+        self.drop_preloaded()
         self.printer.reinit(printer_info['result'], config['result']['status'])
-        self.printer.available_commands = self.apiclient.get_gcode_help()['result']
-        info = self.apiclient.send_request("machine/system_info")
+        if results['gcode_help']:
+            self.printer.available_commands = results['gcode_help']['result']
+        info = results['system_info']
         if info and 'system_info' in info:
             self.printer.system_info = info['system_info']
+        snapshot.update({
+            "available_commands": self.printer.available_commands,
+            "cameras": self.printer.cameras,
+            "power_devices": copy.deepcopy(self.printer.power_devices),
+            "spoolman": self.printer.spoolman,
+        })
+        self.snapshots.save(self.connected_printer, snapshot)
+        if self.recorder is not None:
+            status = {obj: fields for obj, fields in data['result']['status'].items() if obj != "configfile"}
+            self.recorder.write("init", {**snapshot, "status": status})
 
         self.ws_subscribe()
-        extra_items = (self.printer.get_tools()
-                       + self.printer.get_heaters()
-                       + self.printer.get_fans()
-                       + self.printer.get_filament_sensors()
-                       + self.printer.get_output_pins()
-                       + self.printer.get_leds()
-                       )
-
-        data = self.apiclient.send_request("printer/objects/query?" + "&".join(PRINTER_BASE_STATUS_OBJECTS +
-                                                                               extra_items))
-        if data is False:
-            return self._init_printer("Error getting printer object data with extra items")
         if len(self.printer.get_temp_devices()) > 0:
-            self.init_tempstore()
+            self.apply_tempstore(results['server_config'], results['tempstore'])
 
         self.files.initialize()
         self.files.refresh_files()
 
         logging.info("Printer initialized")
+        self.tracer.mark("init_printer")
+        self.tracer.report()
         self.initialized = True
         self.reinit_count = 0
         self.initializing = False
@@ -1097,7 +1382,17 @@ class KlipperScreen(Gtk.Window):
         return False
 
     def init_tempstore(self):
-        tempstore = self.apiclient.send_request("server/temperature_store")
+        self.apply_tempstore(self.apiclient.send_request("server/config"),
+                             self.apiclient.send_request("server/temperature_store"))
+        return False
+
+    def apply_tempstore(self, server_config, tempstore):
+        if server_config:
+            try:
+                self.printer.tempstore_size = server_config["result"]["config"]["data_store"]["temperature_store_size"]
+                logging.info(f"Temperature store size: {self.printer.tempstore_size}")
+            except KeyError:
+                logging.error("Couldn't get the temperature store size")
         if tempstore and 'result' in tempstore and tempstore['result']:
             self.printer.init_temp_store(tempstore['result'])
             if hasattr(self.panels[self._cur_panels[-1]], "update_graph_visibility"):
@@ -1105,15 +1400,6 @@ class KlipperScreen(Gtk.Window):
         else:
             logging.error(f'Tempstore not ready: {tempstore} Retrying in 5 seconds')
             GLib.timeout_add_seconds(5, self.init_tempstore)
-            return
-        server_config = self.apiclient.send_request("server/config")
-        if server_config:
-            try:
-                self.printer.tempstore_size = server_config["result"]["config"]["data_store"]["temperature_store_size"]
-                logging.info(f"Temperature store size: {self.printer.tempstore_size}")
-            except KeyError:
-                logging.error("Couldn't get the temperature store size")
-        return False
 
     def show_keyboard(self, entry=None, event=None):
         if self.keyboard is not None:
@@ -1293,6 +1579,8 @@ def main():
     win.connect("destroy", Gtk.main_quit)
     win.show_all()
     Gtk.main()
+    if win.recorder is not None:
+        win.recorder.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,498 @@
+#!/usr/bin/env python3
+"""Stand-in Moonraker for load testing KlipperScreen without a printer, standard library only
+
+Serves the REST endpoints used by KlippyRest and the websocket JSON-RPC methods of MoonrakerApi,
+for a printer of the configured size, and pushes status updates at the configured rate:
+    python3 scripts/moonraker_sim.py --extruders 4 --sensors 12 --files 5000 --rate 200
+then point a printer section of KlipperScreen.conf to it:
+    [printer sim]
+    moonraker_host: 127.0.0.1
+    moonraker_port: 7125
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import random
+import struct
+import time
+import zlib
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+STATUS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+# Clients with more unsent bytes than this are too slow to keep up and get disconnected
+HIGH_WATER = 4 * 1024 * 1024
+
+
+def make_png(width, height, color):
+    # Solid color RGB image
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    row = b"\x00" + bytes(color) * width
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(row * height))
+        + chunk(b"IEND", b"")
+    )
+
+
+class Printer:
+    """Configuration, status and files of the simulated printer"""
+    thumbnail_sizes = ((32, 32), (300, 300))
+
+    def __init__(self, args):
+        self.args = args
+        self.started = time.monotonic()
+        self.extruders = ["extruder"] + [f"extruder{i}" for i in range(1, args.extruders)]
+        self.heaters = self.extruders + ["heater_bed"]
+        self.sensors = [f"temperature_sensor sensor_{i}" for i in range(args.sensors)]
+        self.fans = ["fan"] + [f"fan_generic fan_{i}" for i in range(args.fans)]
+        self.macros = [f"MACRO_{i}" for i in range(args.macros)]
+        self.config = self.build_config()
+        self.status = self.build_status()
+        self.files = self.build_files()
+        self.thumbnails = {size: make_png(*size, (40, 120, 200)) for size in self.thumbnail_sizes}
+
+    def build_config(self):
+        config = {
+            "printer": {"kinematics": "cartesian", "max_velocity": "300", "max_accel": "3000"},
+            "virtual_sdcard": {"path": "~/printer_data/gcodes"},
+            "pause_resume": {},
+            "display_status": {},
+            "heater_bed": {"heater_pin": "PA1", "sensor_type": "EPCOS 100K B57560G104F", "max_temp": "120"},
+            "fan": {"pin": "PA2"},
+            "bed_mesh": {"mesh_min": "10, 10", "mesh_max": "210, 210", "probe_count": "5, 5"},
+        }
+        for axis in "xyz":
+            config[f"stepper_{axis}"] = {"position_min": "0", "position_max": "220", "position_endstop": "0"}
+        for extruder in self.extruders:
+            config[extruder] = {"heater_pin": "PA0", "sensor_type": "EPCOS 100K B57560G104F", "max_temp": "300",
+                                "nozzle_diameter": "0.400", "filament_diameter": "1.750"}
+        for sensor in self.sensors:
+            config[sensor] = {"sensor_type": "temperature_host"}
+        for fan in self.fans[1:]:
+            config[fan] = {"pin": "PA3"}
+        for macro in self.macros:
+            config[f"gcode_macro {macro.lower()}"] = {"gcode": "\nM117 simulated"}
+        return config
+
+    def build_status(self):
+        status = {
+            "webhooks": {"state": "ready", "state_message": "Printer is ready"},
+            "configfile": {"config": self.config, "settings": {}, "warnings": [], "save_config_pending": False},
+            "print_stats": {"state": "standby", "filename": "", "print_duration": 0, "total_duration": 0,
+                            "filament_used": 0, "message": "", "info": {"current_layer": None, "total_layer": None}},
+            "virtual_sdcard": {"progress": 0, "is_active": False, "file_position": 0, "file_path": None},
+            "display_status": {"progress": 0, "message": None},
+            "idle_timeout": {"state": "Idle", "printing_time": 0},
+            "pause_resume": {"is_paused": False},
+            "toolhead": {"homed_axes": "", "extruder": "extruder", "position": [0, 0, 0, 0],
+                         "max_velocity": 300, "max_accel": 3000, "square_corner_velocity": 5,
+                         "minimum_cruise_ratio": .5, "axis_minimum": [0, 0, 0, 0], "axis_maximum": [220, 220, 220, 0]},
+            "gcode_move": {"gcode_position": [0, 0, 0, 0], "homing_origin": [0, 0, 0, 0], "speed_factor": 1,
+                           "extrude_factor": 1, "speed": 1500, "absolute_coordinates": True,
+                           "absolute_extrude": True},
+            "motion_report": {"live_position": [0, 0, 0, 0], "live_velocity": 0, "live_extruder_velocity": 0},
+            "bed_mesh": {"profile_name": "", "mesh_min": [10, 10], "mesh_max": [210, 210], "probed_matrix": [[]],
+                         "mesh_matrix": [[]], "profiles": {}},
+            "exclude_object": {"objects": [], "excluded_objects": [], "current_object": None},
+            "system_stats": {"sysload": .1, "cputime": 0, "memavail": 500000},
+        }
+        for heater in self.heaters:
+            status[heater] = {"temperature": 22.0, "target": 0, "power": 0}
+        for extruder in self.extruders:
+            status[extruder].update({"pressure_advance": 0, "smooth_time": .04, "can_extrude": False})
+        for sensor in self.sensors:
+            status[sensor] = {"temperature": 35.0, "measured_min_temp": 20, "measured_max_temp": 50}
+        for fan in self.fans:
+            status[fan] = {"speed": 0, "rpm": None}
+        return status
+
+    def build_files(self):
+        files = {}
+        now = time.time()
+        for i in range(self.args.files):
+            directory = f"folder_{i % self.args.dirs}/" if self.args.dirs and i % 3 else ""
+            path = f"{directory}part_{i:05d}.gcode"
+            files[path] = {"path": path, "modified": now - i * 60, "size": 100000 + i * 37, "permissions": "rw"}
+        return files
+
+    def get_metadata(self, filename):
+        info = self.files[filename]
+        directory, _, name = filename.rpartition("/")
+        prefix = f"{directory}/" if directory else ""
+        return {
+            "filename": filename, "size": info['size'], "modified": info['modified'],
+            "slicer": "Simulator", "estimated_time": 3600 + info['size'] % 7200, "layer_height": .2,
+            "first_layer_height": .2, "object_height": 20, "filament_total": 4000, "filament_weight_total": 12,
+            "thumbnails": [
+                {"width": w, "height": h, "size": len(self.thumbnails[(w, h)]),
+                 "relative_path": f".thumbs/{name[:-6]}-{w}x{h}.png", "thumbnail_path": f"{prefix}.thumbs/"}
+                for w, h in self.thumbnail_sizes
+            ],
+        }
+
+    def get_thumbnail(self, path):
+        # gcodes/<dir>/.thumbs/<name>-<w>x<h>.png
+        if "/.thumbs/" not in f"/{path}" or not path.endswith(".png"):
+            return None
+        size = tuple(int(x) for x in path[:-4].rsplit("-", 1)[-1].split("x"))
+        return self.thumbnails.get(size)
+
+    def get_directory(self, path):
+        root = path.split("/", 1)[1] + "/" if "/" in path else ""
+        dirs = {}
+        files = []
+        for filename, info in self.files.items():
+            if not filename.startswith(root):
+                continue
+            rest = filename[len(root):]
+            if "/" in rest:
+                dirname = rest.split("/", 1)[0]
+                dirs[dirname] = max(dirs.get(dirname, 0), info['modified'])
+            else:
+                files.append({"filename": rest, "modified": info['modified'], "size": info['size'],
+                              "permissions": "rw"})
+        return {
+            "dirs": [{"dirname": name, "modified": modified, "size": 4096, "permissions": "rw"}
+                     for name, modified in dirs.items()],
+            "files": files,
+            "disk_usage": {"total": 30 * 2 ** 30, "used": 10 * 2 ** 30, "free": 20 * 2 ** 30},
+            "root_info": {"name": "gcodes", "permissions": "rw"},
+        }
+
+    def query(self, objects):
+        return {obj: self.status[obj] for obj in objects if obj in self.status}
+
+    def temperature_store(self):
+        store = {}
+        for device in self.heaters + self.sensors:
+            temperature = self.status[device]['temperature']
+            store[device] = {"temperatures": [temperature] * 1200}
+            if device in self.heaters:
+                store[device].update({"targets": [0] * 1200, "powers": [0] * 1200})
+        return store
+
+    def gcode_help(self):
+        commands = {"G28": "Home", "M104": "Set extruder temperature", "M140": "Set bed temperature",
+                    "BED_MESH_CALIBRATE": "Perform Mesh Bed Leveling",
+                    "SET_HEATER_TEMPERATURE": "Sets a heater temperature"}
+        commands.update({macro: f"Simulated macro {macro}" for macro in self.macros})
+        return commands
+
+    def set_target(self, heater, target):
+        if heater in self.status and "target" in self.status[heater]:
+            self.status[heater]['target'] = float(target)
+
+    def gcode(self, script):
+        words = script.upper().split()
+        if not words:
+            return
+        params = dict(word.split("=", 1) for word in words[1:] if "=" in word)
+        if words[0] == "SET_HEATER_TEMPERATURE":
+            heater = params.get("HEATER", "").lower()
+            if heater not in self.status and f"heater_generic {heater}" in self.status:
+                heater = f"heater_generic {heater}"
+            self.set_target(heater, params.get("TARGET", 0))
+        elif words[0] in ("M104", "M109"):
+            target = next((word[1:] for word in words[1:] if word.startswith("S")), 0)
+            self.set_target("extruder", target)
+        elif words[0] in ("M140", "M190"):
+            target = next((word[1:] for word in words[1:] if word.startswith("S")), 0)
+            self.set_target("heater_bed", target)
+        elif words[0] == "G28":
+            self.status['toolhead']['homed_axes'] = "xyz"
+
+    def set_print_state(self, state, filename=None):
+        self.status['print_stats']['state'] = state
+        self.status['pause_resume']['is_paused'] = state == "paused"
+        self.status['idle_timeout']['state'] = "Printing" if state in ("printing", "paused") else "Idle"
+        self.status['virtual_sdcard']['is_active'] = state == "printing"
+        if filename is not None:
+            self.status['print_stats'].update({"filename": filename, "print_duration": 0, "total_duration": 0})
+            self.status['virtual_sdcard']['progress'] = 0
+
+    def step(self, dt):
+        # Advances the simulation, returns the fields that changed
+        changed = {}
+        for device in self.heaters + self.sensors:
+            status = self.status[device]
+            target = status.get("target", 0) or (35 if device in self.sensors else 22)
+            temperature = status['temperature'] + (target - status['temperature']) * min(1, dt * .5)
+            temperature = round(temperature + random.uniform(-.2, .2), 2)
+            changed[device] = {"temperature": temperature}
+            status['temperature'] = temperature
+            if device in self.heaters:
+                power = round(max(0.0, min(1.0, (target - temperature) / 10 + .3)) if status['target'] else 0, 3)
+                changed[device]['power'] = status['power'] = power
+        if self.status['print_stats']['state'] == "printing":
+            stats = self.status['print_stats']
+            stats['print_duration'] = stats['total_duration'] = stats['print_duration'] + dt
+            progress = min(1.0, self.status['virtual_sdcard']['progress'] + dt / self.args.print_time)
+            self.status['virtual_sdcard']['progress'] = self.status['display_status']['progress'] = progress
+            position = [round(110 + 100 * random.random(), 3), round(110 + 100 * random.random(), 3),
+                        round(progress * 20, 3), 0]
+            self.status['gcode_move']['gcode_position'] = position
+            self.status['motion_report'].update(live_position=position, live_velocity=round(random.uniform(0, 150), 2))
+            changed['print_stats'] = {"print_duration": stats['print_duration'],
+                                      "total_duration": stats['total_duration']}
+            changed['virtual_sdcard'] = {"progress": progress}
+            changed['display_status'] = {"progress": progress}
+            changed['gcode_move'] = {"gcode_position": position}
+            changed['motion_report'] = {"live_position": position,
+                                        "live_velocity": self.status['motion_report']['live_velocity']}
+            if progress >= 1:
+                self.set_print_state("complete")
+                changed['print_stats'] = self.status['print_stats']
+                changed['idle_timeout'] = self.status['idle_timeout']
+        return changed
+
+
+class Client:
+    def __init__(self, writer):
+        self.writer = writer
+        self.subscriptions = {}
+
+    def send(self, message):
+        payload = json.dumps(message).encode()
+        if len(payload) < 126:
+            header = struct.pack(">BB", 0x81, len(payload))
+        elif len(payload) < 2 ** 16:
+            header = struct.pack(">BBH", 0x81, 126, len(payload))
+        else:
+            header = struct.pack(">BBQ", 0x81, 127, len(payload))
+        self.writer.write(header + payload)
+
+    def notify(self, method, params):
+        self.send({"jsonrpc": "2.0", "method": method, "params": params})
+
+    def filter(self, changed):
+        # Only the subscribed objects and fields, None subscribes to every field
+        data = {}
+        for obj, fields in changed.items():
+            if obj not in self.subscriptions:
+                continue
+            wanted = self.subscriptions[obj]
+            fields = fields if wanted is None else {k: v for k, v in fields.items() if k in wanted}
+            if fields:
+                data[obj] = fields
+        return data
+
+
+class Server:
+    def __init__(self, args):
+        self.args = args
+        self.printer = Printer(args)
+        self.clients = set()
+        self.messages = 0
+
+    # REST
+
+    def rest(self, method, path, query, body):
+        if path.startswith("server/files/gcodes/"):
+            thumbnail = self.printer.get_thumbnail(unquote(path[len("server/files/gcodes/"):]))
+            return (200, "image/png", thumbnail) if thumbnail else (404, "text/plain", b"Not Found")
+        routes = {
+            "server/info": lambda: {
+                "klippy_connected": True, "klippy_state": "ready", "moonraker_version": "simulator",
+                "components": ["file_manager", "machine", "data_store", "webcam", "power"],
+                "failed_components": [], "warnings": [], "missing_klippy_requirements": [],
+                "registered_directories": ["config", "gcodes"], "websocket_count": len(self.clients),
+            },
+            "access/oneshot_token": lambda: "simulated-token",
+            "printer/info": lambda: {
+                "state": "ready", "state_message": "Printer is ready", "hostname": "simulator",
+                "software_version": "v0.12.0-simulator", "cpu_info": "simulated",
+            },
+            "printer/gcode/help": self.printer.gcode_help,
+            "printer/objects/query": lambda: {
+                "eventtime": self.eventtime(), "status": self.printer.query(obj for obj, _ in query),
+            },
+            "server/temperature_store": self.printer.temperature_store,
+            "server/config": lambda: {"config": {"data_store": {"temperature_store_size": 1200}}},
+            "machine/system_info": lambda: {"system_info": {"cpu_info": {"cpu_count": 4}, "distribution": {}}},
+            "server/webcams/list": lambda: {"webcams": []},
+            "machine/device_power/devices": lambda: {"devices": []},
+        }
+        if path not in routes:
+            return 404, "application/json", json.dumps({"error": {"code": 404, "message": "Not Found"}}).encode()
+        return 200, "application/json", json.dumps({"result": routes[path]()}).encode()
+
+    # Websocket JSON-RPC
+
+    def rpc(self, client, method, params):
+        # The result or the error of the response
+        printer = self.printer
+        if method == "server.files.list":
+            return {"result": list(printer.files.values())}
+        if method == "server.files.get_directory":
+            return {"result": printer.get_directory(params.get("path", "gcodes"))}
+        if method == "server.files.metadata":
+            if params.get("filename") not in printer.files:
+                return {"error": {"code": 404, "message": f"Metadata not available for {params.get('filename')}"}}
+            return {"result": printer.get_metadata(params['filename'])}
+        if method == "printer.objects.subscribe":
+            client.subscriptions = params.get("objects", {})
+            status = client.filter(printer.query(client.subscriptions))
+            return {"result": {"eventtime": self.eventtime(), "status": status}}
+        if method == "printer.gcode.script":
+            printer.gcode(params.get("script", ""))
+            self.broadcast({obj: printer.status[obj] for obj in printer.heaters + ["toolhead"]})
+            return {"result": "ok"}
+        if method == "printer.print.start":
+            printer.set_print_state("printing", params.get("filename", ""))
+        elif method in ("printer.print.pause", "printer.print.resume", "printer.print.cancel"):
+            state = {"pause": "paused", "resume": "printing", "cancel": "cancelled"}[method.rsplit(".", 1)[1]]
+            printer.set_print_state(state)
+        if method.startswith("printer.print."):
+            self.broadcast({obj: printer.status[obj] for obj in
+                            ("print_stats", "pause_resume", "idle_timeout", "virtual_sdcard")})
+            return {"result": "ok"}
+        if method in ("printer.emergency_stop", "printer.restart", "printer.firmware_restart"):
+            return {"result": "ok"}
+        if method.startswith("machine.device_power."):
+            return {"result": {device: method.rsplit(".", 1)[1] for device in params}}
+        return {"error": {"code": -32601, "message": f"Method not found: {method}"}}
+
+    def broadcast(self, changed):
+        for client in list(self.clients):
+            data = client.filter(changed)
+            if data:
+                client.notify("notify_status_update", [data, self.eventtime()])
+                self.messages += 1
+
+    def eventtime(self):
+        return round(time.monotonic() - self.printer.started, 3)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request = await reader.readuntil(b"\r\n\r\n")
+                lines = request.decode("latin-1").split("\r\n")
+                method, target, _ = lines[0].split(" ", 2)
+                headers = {
+                    k.strip().lower(): v.strip() for k, _, v in (line.partition(":") for line in lines[1:] if line)
+                }
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                url = urlsplit(target)
+                if url.path == "/websocket" and headers.get("upgrade", "").lower() == "websocket":
+                    await self.websocket(reader, writer, headers)
+                    return
+                status, content_type, payload = self.rest(method, url.path.strip("/"),
+                                                          parse_qsl(url.query, keep_blank_values=True), body)
+                writer.write(
+                    f"HTTP/1.1 {status} {STATUS[status]}\r\nContent-Type: {content_type}\r\n"
+                    f"Content-Length: {len(payload)}\r\nConnection: keep-alive\r\n\r\n".encode() + payload
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def websocket(self, reader, writer, headers):
+        accept = base64.b64encode(hashlib.sha1((headers['sec-websocket-key'] + WEBSOCKET_GUID).encode()).digest())
+        writer.write(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                     b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+        client = Client(writer)
+        self.clients.add(client)
+        logging.info(f"Websocket connected, {len(self.clients)} clients")
+        try:
+            while True:
+                opcode, payload = await self.read_frame(reader)
+                if opcode == 8:
+                    writer.write(struct.pack(">BB", 0x88, 0))
+                    return
+                if opcode == 9:
+                    writer.write(struct.pack(">BB", 0x8A, len(payload)) + payload)
+                    continue
+                if opcode != 1:
+                    continue
+                request = json.loads(payload)
+                response = {"jsonrpc": "2.0", "id": request.get("id")}
+                try:
+                    response.update(self.rpc(client, request.get("method"), request.get("params") or {}))
+                except Exception as e:
+                    response['error'] = {"code": 400, "message": str(e)}
+                client.send(response)
+                await writer.drain()
+        finally:
+            self.clients.discard(client)
+            logging.info(f"Websocket disconnected, {len(self.clients)} clients")
+
+    @staticmethod
+    async def read_frame(reader):
+        first, second = await reader.readexactly(2)
+        length = second & 0x7F
+        if length == 126:
+            length = struct.unpack(">H", await reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack(">Q", await reader.readexactly(8))[0]
+        mask = await reader.readexactly(4) if second & 0x80 else bytes(4)
+        payload = await reader.readexactly(length)
+        return first & 0x0F, bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+    async def push_status(self):
+        interval = 1 / self.args.rate
+        last = report = time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            self.broadcast(self.printer.step(now - last))
+            last = now
+            self.drop_slow_clients()
+            if now - report >= 1:
+                for client in list(self.clients):
+                    client.notify("notify_proc_stat_update", [{
+                        "system_cpu_usage": {"cpu": round(random.uniform(5, 30), 1)},
+                        "system_memory": {"total": 1000000, "available": 600000, "used": 400000},
+                        "moonraker_stats": {"time": time.time(), "cpu_usage": 1, "memory": 30000, "mem_units": "kB"},
+                        "websocket_connections": len(self.clients), "cpu_temp": 45, "network": {},
+                    }])
+                logging.info(f"{self.messages / (now - report):.0f} status updates/s to {len(self.clients)} clients")
+                self.messages = 0
+                report = now
+
+    def drop_slow_clients(self):
+        # A stalled client must not make the simulator buffer without limit
+        for client in list(self.clients):
+            if client.writer.transport.get_write_buffer_size() > HIGH_WATER:
+                logging.warning("Disconnecting a client that doesn't keep up with the updates")
+                self.clients.discard(client)
+                client.writer.transport.abort()
+
+    async def run(self):
+        server = await asyncio.start_server(self.handle, self.args.host, self.args.port)
+        logging.info(f"Simulating a printer with {len(self.printer.extruders)} extruders, "
+                     f"{len(self.printer.sensors)} sensors, {len(self.printer.files)} files "
+                     f"on {self.args.host}:{self.args.port}")
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.push_status())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Moonraker simulator for load testing KlipperScreen")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7125)
+    parser.add_argument("--extruders", type=int, default=1)
+    parser.add_argument("--sensors", type=int, default=2, help="Number of temperature sensors")
+    parser.add_argument("--fans", type=int, default=1, help="Number of generic fans besides the part fan")
+    parser.add_argument("--macros", type=int, default=20)
+    parser.add_argument("--files", type=int, default=100, help="Number of gcode files, each one with thumbnails")
+    parser.add_argument("--dirs", type=int, default=5, help="Number of directories the files are spread in")
+    parser.add_argument("--rate", type=float, default=4, help="Status updates per second")
+    parser.add_argument("--print-time", type=float, default=600, help="Seconds a simulated print lasts")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    try:
+        asyncio.run(Server(args).run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
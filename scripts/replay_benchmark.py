@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""Replays a recording of the Moonraker websocket through the KlipperScreen dispatch, reporting throughput and latency
+
+Frames go through KlippyWebsocket.on_message, status updates are coalesced as configured by status_update_rate
+
+Record the traffic setting websocket_record in [main], for example:
+    websocket_record: ~/printer_data/logs/websocket.jsonl.gz
+then replay it:
+    ~/.KlipperScreen-env/bin/python scripts/replay_benchmark.py ~/printer_data/logs/websocket.jsonl.gz
+    ~/.KlipperScreen-env/bin/python scripts/replay_benchmark.py recording.jsonl.gz --speed 10 \\
+        --panel main_menu --panel temperature --save baseline.json
+    ~/.KlipperScreen-env/bin/python scripts/replay_benchmark.py recording.jsonl.gz --baseline baseline.json
+
+Panels are built in an offscreen window, they need a display (xvfb-run or GDK_BACKEND=broadway work)
+the last panel is on top and gets the updates, as in KlipperScreen
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+import types
+from importlib import import_module
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gi
+
+gi.require_version("Gtk", "3.0")
+from gi.repository import GLib
+from ks_includes.config import KlipperScreenConfig
+from ks_includes.KlippyWebsocket import KlippyWebsocket
+from ks_includes.printer import Printer
+from ks_includes.recorder import read_recording
+
+
+class NoOp:
+    """Stands for anything the panels reach that isn't part of the replay, calls and attributes do nothing"""
+    def __getattr__(self, name):
+        return self
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+
+class NoPanel:
+    """Stands for the base panel, which isn't part of the replay"""
+    subscriptions = None
+
+    def process_update(self, action, data):
+        pass
+
+
+class ReplayScreen:
+    """The parts of KlipperScreen the dispatch and the panels use, the rest of the screen and the api are no-ops
+
+    Messages go through the same KlippyWebsocket, KlipperScreen._websocket_callback and process_update
+    as when connected, the websocket is never connected so the requests of the panels are dropped
+    """
+    def __init__(self, printer, configfile):
+        import screen
+
+        self.printer = printer
+        self.recorder = None
+        self.updates = 0
+        self.files = NoOp()
+        self.panels = {}
+        self._cur_panels = []
+        self.dialogs = []
+        self.base_panel = NoPanel()
+        self.connecting = False
+        self.initialized = True
+        self.setup_init = 0
+        self.connecting_to_printer = self.connected_printer = "replay"
+        self._websocket_callback = types.MethodType(screen.KlipperScreen._websocket_callback, self)
+        self.process_update = types.MethodType(screen.KlipperScreen.process_update, self)
+        self.route_update = screen.KlipperScreen.route_update
+        self._config = KlipperScreenConfig(configfile, self)
+        self._ws = KlippyWebsocket(self, {"on_message": self.on_message}, "replay", 0)
+
+    def on_message(self, action, data):
+        self.updates += 1
+        self._websocket_callback(action, data)
+
+    def setup_panels(self, width, height):
+        from gi.repository import Gtk
+        import screen
+        from ks_includes.KlippyGtk import KlippyGtk
+
+        self.width = width
+        self.height = height
+        self.vertical_mode = width < height
+        self.theme = "colorized"
+        self.show_cursor = False
+        self.gtk = KlippyGtk(self)
+        screen.KlipperScreen.init_style(self)
+        self.window = Gtk.OffscreenWindow()
+        self.window.set_default_size(width, height)
+        self.box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        self.window.add(self.box)
+
+    def __getattr__(self, name):
+        return NoOp()
+
+    def add_panel(self, name):
+        panel = import_module(f"panels.{name}").Panel(self, name)
+        self.panels[name] = panel
+        self._cur_panels.append(name)
+        self.box.pack_start(panel.content, True, True, 0)
+        self.window.show_all()
+        if hasattr(panel, "activate"):
+            panel.activate()
+        return panel
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def drain():
+    # Runs everything the update queued: idle callbacks, redraws of the panels
+    context = GLib.MainContext.default()
+    while context.pending():
+        context.iteration(False)
+
+
+def replay(args):
+    printer = Printer(lambda callback: callback(), {}, lambda busy: False)
+    init = None
+    frames = []
+    for t, kind, payload in read_recording(args.recording):
+        if kind == "init":
+            # Replays start from the last initialization before the frames
+            init = payload
+            frames = []
+        elif kind == "ws":
+            frames.append((t, payload))
+    if init is None or not frames:
+        sys.exit("The recording has no initialization followed by frames")
+    printer.reinit(init['printer_info'], {"configfile": init['configfile']})
+    printer.available_commands = init.get('available_commands', {})
+    printer.process_update(init['status'])
+    screen = ReplayScreen(printer, os.path.expanduser(args.configfile))
+    if args.panel:
+        screen.setup_panels(args.width, args.height)
+        for name in args.panel:
+            screen.add_panel(name)
+    drain()
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    gc.collect()
+    collections = [stats['collections'] for stats in gc.get_stats()]
+    blocks = sys.getallocatedblocks()
+    latencies = []
+    first = frames[0][0]
+    start = time.perf_counter()
+    for t, message in frames:
+        if args.speed > 0:
+            delay = start + (t - first) / args.speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        begin = time.perf_counter()
+        screen._ws.on_message(message)
+        drain()
+        latencies.append(time.perf_counter() - begin)
+    # Deliver the status still waiting for the next dispatch
+    screen._ws.status.flush_pending()
+    drain()
+    wall = time.perf_counter() - start
+
+    result = {
+        "frames": len(latencies),
+        "updates": screen.updates,
+        "panels": args.panel or [],
+        "speed": args.speed,
+        "throughput": len(latencies) / max(sum(latencies), 1e-9),
+        "wall_time": wall,
+        "latency_ms": {},
+        "gc_collections": [stats['collections'] - before for stats, before in zip(gc.get_stats(), collections)],
+        "allocated_blocks": sys.getallocatedblocks() - blocks,
+    }
+    latencies.sort()
+    for name, fraction in (("p50", .5), ("p90", .9), ("p99", .99), ("max", 1)):
+        result["latency_ms"][name] = percentile(latencies, fraction) * 1000
+    if args.tracemalloc:
+        result["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def compare(result, baseline, tolerance):
+    # Higher latencies or lower throughput than the baseline by more than the tolerance are regressions
+    regressions = []
+    for name in ("p50", "p90", "p99"):
+        if result["latency_ms"][name] > baseline["latency_ms"][name] * (1 + tolerance):
+            regressions.append(f"{name} {baseline['latency_ms'][name]:.3f} -> {result['latency_ms'][name]:.3f} ms")
+    if result["throughput"] < baseline["throughput"] * (1 - tolerance):
+        regressions.append(f"throughput {baseline['throughput']:.0f} -> {result['throughput']:.0f} msg/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay benchmark of recorded Moonraker websocket traffic")
+    parser.add_argument("recording", help="Recording written by websocket_record")
+    parser.add_argument("--speed", type=float, default=0, help="1 for real time, 10 for ten times faster, 0 for max")
+    parser.add_argument("--panel", action="append", help="Panel to open, can be repeated, the last gets the updates")
+    parser.add_argument("-c", "--configfile", default="~/KlipperScreen.conf",
+                        help="Configuration, for the status rate and the panels")
+    parser.add_argument("--width", type=int, default=800)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--tracemalloc", action="store_true", help="Trace the peak memory, slows the replay")
+    parser.add_argument("--save", help="Write the results as JSON, to be used as a baseline")
+    parser.add_argument("--baseline", help="Results to compare with, exits with 1 if there is a regression")
+    parser.add_argument("--tolerance", type=float, default=.1, help="Allowed regression over the baseline")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    result = replay(args)
+    print(json.dumps(result, indent=2))
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(result, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(result, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()